@@ -0,0 +1,90 @@
+"""Import time budget of the web service.
+
+Imports the service in fresh interpreters like a uvicorn worker does, reports the
+slowest imports and exits with an error if the import takes longer than the budget
+or if any of the feed update dependencies are imported by the serving path.
+
+    python loadtest/importtime.py
+    python loadtest/importtime.py --budget-ms 600 --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Sets the settings the service requires
+from loadtest import SRC_DIR
+
+MODULE = "service"
+# Needed only by the feed updater, see feed_update.py
+UPDATE_ONLY_MODULES = (
+    "apscheduler",
+    "dateutil",
+    "feed_update",
+    "httpx",
+    "jsonpath_ng",
+    "pebble",
+    "PIL",
+    "pydantic_xml",
+    "rss_feed.models",
+    "sentry_sdk",
+)
+
+
+def environment() -> dict:
+    # Sentry is imported only when it is configured
+    return dict(os.environ, SENTRY_DSN="")
+
+
+def import_times() -> tuple[float, list]:
+    """Total import time in milliseconds and the (cumulative ms, module) of each import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+        cwd=SRC_DIR, env=environment(), capture_output=True, text=True, check=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imports.append((int(cumulative) / 1000, name.strip()))
+    return dict((name, cumulative) for cumulative, name in imports)[MODULE], imports
+
+
+def imported_modules() -> set:
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, {MODULE}; print('\\n'.join(sys.modules))"],
+        cwd=SRC_DIR, env=environment(), capture_output=True, text=True, check=True
+    )
+    return set(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=750, help="maximum median import time of the service")
+    parser.add_argument("--runs", type=int, default=5, help="amount of fresh interpreters to measure")
+    parser.add_argument("--top", type=int, default=15, help="amount of slowest imports to report")
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    median = statistics.median(total for total, _ in runs)
+    print(f"import {MODULE}: median {median:.1f} ms over {args.runs} runs, budget {args.budget_ms:.0f} ms")
+    print("\nslowest imports (cumulative ms, last run):")
+    for cumulative, name in sorted(runs[-1][1], reverse=True)[:args.top]:
+        print(f"{cumulative:10.1f}  {name}")
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"import time {median:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+    modules = imported_modules()
+    for name in UPDATE_ONLY_MODULES:
+        if name in modules:
+            failures.append(f"{name} is imported by the serving path")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
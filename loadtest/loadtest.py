@@ -0,0 +1,452 @@
+"""Load test for the /events serving path.
+
+Renders synthetic feeds of the given sizes, seeds them to an in-memory cache or a
+local memcached, starts the service without the feed update job and drives /events
+with a mix of plain, conditional, compressed and missing feed requests. Reports
+latency percentiles, throughput and server CPU time per request.
+
+    python loadtest/loadtest.py --sizes 10,100,1000 --concurrency 32 --duration 30
+    python loadtest/loadtest.py --backend memcached --memcached unix:/run/memcached/memcached.sock --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pickle
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timedelta, timezone
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC_DIR = os.path.join(ROOT_DIR, "src")
+sys.path.insert(0, SRC_DIR)
+# The in-memory cache is shared with the tests
+sys.path.insert(0, ROOT_DIR)
+
+# Settings the service requires, so that the load test runs without an .env file
+for name, value in {
+    "APP_TITLE": "Linked Events RSS load test",
+    "APP_VERSION": "0.0.0",
+    "FEED_BASE_URL": "http://localhost",
+    "LINKED_EVENTS_BASE_URL": "http://localhost/linkedevents/v1",
+    "KIRKANTA_BASE_URL": "http://localhost/kirkanta/v4",
+    "CACHE_TTL": "3600",
+    "CACHE_MAX_SIZE": "3600",
+    "UVICORN_WORKERS": "1",
+    "CONSORTIUM_ID": "0",
+    "API_CLIENT_POOL_SIZE": "1",
+    "LOG_LEVEL": "WARNING",
+}.items():
+    os.environ.setdefault(name, value)
+
+REQUEST_TYPES = ("plain", "conditional", "gzip", "limit", "missing")
+# The responses that show the server acted on the header the request type sends
+HONORED = {
+    "conditional": ("304 Not Modified", lambda response: response.status_code == 304),
+    "gzip": ("Content-Encoding: gzip", lambda response: response.headers.get("Content-Encoding") == "gzip"),
+}
+
+
+def feed_location(size: int, index: int) -> str:
+    return f"loadtest:{size:06d}{index:03d}"
+
+
+def render_feeds(sizes: list[int], feeds_per_size: int, languages: list[str], limits: list[int]) -> dict:
+    """Feeds built with the service's own models so that their size and shape match
+    real feeds. Dates are fixed so that every server worker gets identical bytes."""
+    from rss_feed import GUID, Enclosure, EventMeta, Image, Item, RSSFeed
+
+    start = datetime(2026, 1, 1, 10, tzinfo=timezone.utc)
+    words = "kirjasto tapahtuma satutunti lukupiiri näyttely konsertti työpaja elokuva keskustelu".split()
+    values = {}
+    for size in sizes:
+        for index in range(feeds_per_size):
+            location = feed_location(size, index)
+            for lang in languages:
+                items = []
+                for n in range(size):
+                    title = " ".join(random.Random(n).choices(words, k=4)).capitalize()
+                    description = " ".join(random.Random(-n).choices(words, k=40)).capitalize() + "."
+                    url = f"https://example.org/FeedContent/LinkedEvents?id=loadtest:{n}"
+                    image = f"https://example.org/images/{n}.jpg"
+                    dtstart = start + timedelta(hours=n)
+                    items.append(Item(
+                        title=title,
+                        link=url,
+                        description=description,
+                        author="kirjasto@example.org",
+                        enclosure=Enclosure(url=image, length=0, type="image"),
+                        guid=GUID(content=f"https://example.org/linkedevents/v1/event/loadtest:{n}"),
+                        pub_date=start,
+                        xcal_title=title,
+                        xcal_featured=Image(url=image, title=title, link=image, width=0, height=0),
+                        xcal_dtstart=dtstart,
+                        xcal_dtend=dtstart + timedelta(hours=2),
+                        xcal_content=description,
+                        xcal_organizer="Kirjasto",
+                        xcal_location="Kirjasto",
+                        xcal_location_address="Kirjastokatu 1",
+                        xcal_location_city="Helsinki",
+                        xcal_url=url,
+                        event_location="Kirjasto",
+                        event_location_address="Kirjastokatu 1",
+                        event_location_city="Helsinki",
+                        event_organizer="Kirjasto",
+                        event_organizer_url=url,
+                        event_meta=EventMeta(dtstart=dtstart, dtend=dtstart + timedelta(hours=2)),
+                    ))
+                feed = RSSFeed(content={
+                    "title": "Kirjasto",
+                    "link": f"http://localhost/events?location={location}&preferred_language={lang}",
+                    "description": "Kirjasto",
+                    "language": "",
+                    "pub_date": start,
+                    "last_build_date": start,
+                    "ttl": 3600,
+                    "item": items,
+                })
+                render = lambda: feed.to_xml(pretty_print=False, encoding="UTF-8", standalone=True, skip_empty=True)  # noqa: E731
+                values[f"{location},{lang}"] = render()
+                for limit in limits:
+                    feed.content.item = items[:limit]
+                    values[f"{location},{lang},{limit}"] = render()
+                feed.content.item = items
+    return values
+
+
+def store_feeds(client, feeds: dict, compression_level: int):
+    """Write the feeds like the feed update job does, as a new compressed generation."""
+    from feed_cache import FeedCacheWriter, compress
+
+    writer = FeedCacheWriter(client, compression_level)
+    writer.add({key: compress(value, compression_level) for key, value in feeds.items()})
+    writer.publish()
+
+
+def create_app():
+    """uvicorn app factory, called in each server worker process."""
+    import service
+    from contextlib import asynccontextmanager
+    from feed_cache import CacheSerde, FeedCache
+    from settings import FEED_CACHE_COMPRESSION_LEVEL, FEED_CACHE_POOL_SIZE
+    from tests.memory_cache import MemoryCache
+
+    @asynccontextmanager
+    async def no_feed_updates(app):
+        yield
+
+    if os.environ["LOADTEST_BACKEND"] == "memory":
+        service.memcached_client = MemoryCache(CacheSerde())
+        with open(os.environ["LOADTEST_FEEDS_FILE"], "rb") as f:
+            store_feeds(service.memcached_client, pickle.load(f), FEED_CACHE_COMPRESSION_LEVEL)
+        service.feed_cache = FeedCache(service.memcached_client)
+    else:
+        from pymemcache.client import base
+        service.memcached_client = base.Client(os.environ["LOADTEST_MEMCACHED"], serde=CacheSerde())
+        service.feed_cache = FeedCache(base.PooledClient(
+            os.environ["LOADTEST_MEMCACHED"], serde=CacheSerde(), max_pool_size=FEED_CACHE_POOL_SIZE, no_delay=True
+        ))
+    service.app.router.lifespan_context = no_feed_updates
+    if not os.environ.get("LOADTEST_ACCESS_LOG"):
+        logging.getLogger("uvicorn.access").disabled = True
+    return service.app
+
+
+def serve(args):
+    import uvicorn
+    os.environ["LOADTEST_BACKEND"] = args.backend
+    os.environ["LOADTEST_FEEDS_FILE"] = args.feeds_file or ""
+    os.environ["LOADTEST_MEMCACHED"] = args.memcached
+    os.environ["LOADTEST_ACCESS_LOG"] = "1" if args.access_log else ""
+    uvicorn.run(
+        "loadtest:create_app",
+        factory=True,
+        host="127.0.0.1",
+        port=args.port,
+        workers=args.workers,
+        log_level="warning",
+        access_log=False,
+    )
+
+
+def process_tree_cpu_seconds(pid: int):
+    """User and system CPU time of a process and its live children from /proc."""
+    def stat(pid):
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return int(fields[1]), (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    try:
+        total = stat(pid)[1]
+    except OSError:
+        return None
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                ppid, cpu = stat(int(entry))
+            except OSError:
+                continue
+            if ppid == pid:
+                total += cpu
+    return total
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in REQUEST_TYPES:
+            raise argparse.ArgumentTypeError(f"Unknown request type {name}, expected one of {', '.join(REQUEST_TYPES)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class RequestMix:
+    def __init__(self, args, locations: list[str], limits: list[int]):
+        self.names, self.weights = zip(*parse_mix(args.mix).items())
+        if "limit" in self.names and not limits:
+            raise SystemExit("The limit request type needs --limits")
+        self.locations = locations
+        self.languages = args.languages
+        self.limits = limits
+        self.etags = {}
+        self.rng = random.Random(args.seed)
+
+    def next(self):
+        kind = self.rng.choices(self.names, self.weights)[0]
+        location = self.rng.choice(self.locations)
+        lang = self.rng.choice(self.languages)
+        params = {"location": location, "preferred_language": lang}
+        headers = {"Accept-Encoding": "identity"}
+        if kind == "missing":
+            params["location"] = "loadtest:999999999"
+        elif kind == "conditional" and (location, lang) in self.etags:
+            headers["If-None-Match"] = self.etags[(location, lang)]
+        elif kind == "gzip":
+            headers["Accept-Encoding"] = "gzip"
+        elif kind == "limit":
+            params["limit"] = str(self.rng.choice(self.limits))
+        return kind, params, headers
+
+
+def summary(latencies: list[float]) -> dict:
+    return {
+        "requests": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else float("nan"),
+    }
+
+
+async def drive(args, locations: list[str], limits: list[int]) -> dict:
+    import httpx
+
+    mix = RequestMix(args, locations, limits)
+    results = {name: [] for name in REQUEST_TYPES}
+    statuses = {}
+    honored = {name: 0 for name in HONORED}
+    received = [0]
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        # Warm up and collect the ETags for the conditional requests
+        for location in locations:
+            for lang in args.languages:
+                response = await client.get("/events", params={"location": location, "preferred_language": lang})
+                if response.status_code != 200:
+                    raise SystemExit(f"Feed {location},{lang} not served: HTTP {response.status_code}")
+                if "ETag" in response.headers:
+                    mix.etags[(location, lang)] = response.headers["ETag"]
+
+        deadline = time.perf_counter() + args.duration
+        remaining = [args.requests or float("inf")]
+
+        async def worker():
+            while time.perf_counter() < deadline and remaining[0] > 0:
+                remaining[0] -= 1
+                kind, params, headers = mix.next()
+                start = time.perf_counter()
+                try:
+                    response = await client.get("/events", params=params, headers=headers)
+                    status = response.status_code
+                    received[0] += response.num_bytes_downloaded
+                    if kind in HONORED and HONORED[kind][1](response):
+                        honored[kind] += 1
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                results[kind].append(time.perf_counter() - start)
+                statuses[f"{kind} {status}"] = statuses.get(f"{kind} {status}", 0) + 1
+
+        server_cpu_start = process_tree_cpu_seconds(args.server_pid) if args.server_pid else None
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+        server_cpu_end = process_tree_cpu_seconds(args.server_pid) if args.server_pid else None
+
+    all_latencies = [latency for latencies in results.values() for latency in latencies]
+    report = {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "duration_s": elapsed,
+        "throughput_rps": len(all_latencies) / elapsed if elapsed else 0,
+        "received_mb": received[0] / 1e6,
+        "overall": summary(all_latencies),
+        "by_type": {name: summary(latencies) for name, latencies in results.items() if latencies},
+        "statuses": dict(sorted(statuses.items())),
+        "honored": {name: {"responses": amount, "requests": len(results[name])} for name, amount in honored.items() if results[name]},
+        "server_cpu_ms_per_request": None,
+    }
+    if server_cpu_start is not None and server_cpu_end is not None and all_latencies:
+        report["server_cpu_ms_per_request"] = (server_cpu_end - server_cpu_start) / len(all_latencies) * 1000
+    return report
+
+
+def print_report(report: dict, args):
+    print(f"\n/events load test: {report['url']}, concurrency {report['concurrency']}, {report['duration_s']:.1f} s")
+    print(f"Throughput: {report['throughput_rps']:.1f} requests/s, {report['received_mb']:.1f} MB received")
+    if report["server_cpu_ms_per_request"] is not None:
+        print(f"Server CPU: {report['server_cpu_ms_per_request']:.2f} ms/request")
+    print(f"\n{'type':<12}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, row in [("overall", report["overall"])] + list(report["by_type"].items()):
+        print(f"{name:<12}{row['requests']:>10}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}")
+    print("\nResponses: " + ", ".join(f"{name}: {amount}" for name, amount in report["statuses"].items()))
+    for name, row in report["honored"].items():
+        # Otherwise the row only measures sending the header, the response is the same as for plain requests
+        note = "" if row["responses"] else ", the server ignores the header"
+        print(f"{name}: {row['responses']} of {row['requests']} responses with {HONORED[name][0]}{note}")
+
+    failed = []
+    for p in ("p50", "p95", "p99"):
+        slo = getattr(args, f"slo_{p}_ms")
+        if slo is not None:
+            value = report["overall"][f"{p}_ms"]
+            print(f"SLO {p} <= {slo} ms: {'OK' if value <= slo else 'FAILED'} ({value:.2f} ms)")
+            if value > slo:
+                failed.append(p)
+    return failed
+
+
+def wait_until_up(url: str, process, timeout: float = 60):
+    import httpx
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}/status", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit("Server didn't start")
+
+
+def run(args):
+    sizes = [int(size) for size in args.sizes.split(",")]
+    limits = [int(limit) for limit in args.limits.split(",") if limit.strip()]
+    locations = [feed_location(size, index) for size in sizes for index in range(args.feeds_per_size)]
+
+    server = None
+    feeds_file = None
+    if not args.url:
+        print(f"Rendering {len(locations) * len(args.languages)} feeds with {args.sizes} items...", flush=True)
+        feeds = render_feeds(sizes, args.feeds_per_size, args.languages, limits)
+        if args.backend == "memcached":
+            from pymemcache.client import base
+            from feed_cache import CacheSerde
+            store_feeds(base.Client(args.memcached, serde=CacheSerde()), feeds, int(os.getenv("FEED_CACHE_COMPRESSION_LEVEL", default=6)))
+        else:
+            feeds_file = tempfile.NamedTemporaryFile(suffix=".pickle", delete=False)
+            pickle.dump(feeds, feeds_file)
+            feeds_file.close()
+
+        args.url = f"http://127.0.0.1:{args.port}"
+        env = dict(os.environ, FEED_LIMIT_VARIANTS=",".join(str(limit) for limit in limits))
+        command = [
+            sys.executable, os.path.abspath(__file__), "serve",
+            "--backend", args.backend, "--memcached", args.memcached,
+            "--port", str(args.port), "--workers", str(args.workers),
+        ] + (["--feeds-file", feeds_file.name] if feeds_file else []) + (["--access-log"] if args.access_log else [])
+        server = subprocess.Popen(command, env=env, cwd=SRC_DIR)
+        args.server_pid = server.pid
+
+    args.url = args.url.rstrip("/")
+    try:
+        if server is not None:
+            wait_until_up(args.url, server)
+        report = asyncio.run(drive(args, locations, limits))
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if feeds_file is not None:
+            os.unlink(feeds_file.name)
+
+    failed = print_report(report, args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="Run the service with seeded feeds (used by the load test)")
+    serve_parser.add_argument("--backend", choices=("memory", "memcached"), default="memory")
+    serve_parser.add_argument("--feeds-file")
+    serve_parser.add_argument("--memcached", default="unix:/run/memcached/memcached.sock")
+    serve_parser.add_argument("--port", type=int, default=8100)
+    serve_parser.add_argument("--workers", type=int, default=1)
+    serve_parser.add_argument("--access-log", action="store_true")
+
+    parser.add_argument("--url", help="Test an already running service instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="Measure the CPU time of this server process with --url")
+    parser.add_argument("--backend", choices=("memory", "memcached"), default="memory",
+                        help="Feed cache of the started service (default: memory)")
+    parser.add_argument("--memcached", default="unix:/run/memcached/memcached.sock", help="memcached address for --backend memcached")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("UVICORN_WORKERS", 1)), help="uvicorn workers of the started service")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--access-log", action="store_true", help="Keep the uvicorn access log of the started service enabled")
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma separated feed sizes in items (default: 10,100,1000)")
+    parser.add_argument("--feeds-per-size", type=int, default=5)
+    parser.add_argument("--languages", type=lambda value: value.split(","), default=["fi", "sv", "en"])
+    parser.add_argument("--limits", default="10,50", help="Feed limit variants to seed for the limit request type")
+    parser.add_argument("--mix", default="plain=55,conditional=20,gzip=15,limit=5,missing=5",
+                        help=f"Request type weights, types: {', '.join(REQUEST_TYPES)}")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="Test duration in seconds")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0: run for --duration)")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--slo-p50-ms", type=float)
+    parser.add_argument("--slo-p95-ms", type=float)
+    parser.add_argument("--slo-p99-ms", type=float)
+    parser.add_argument("--json", help="Also write the report as JSON to this file")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+        return 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,7 @@
 #! /usr/bin/bash
 memcached -d -m 1024 -u memcache -c 1024 -P /var/run/memcached/memcached.pid -s /var/run/memcached/memcached.sock -a 0755
-python3 main.py
\ No newline at end of file
+if [ "${FEED_UPDATER}" = "process" ]; then
+    # Restart the feed updater if it exits
+    (while true; do python3 updater.py; sleep 10; done) &
+fi
+python3 main.py
@@ -0,0 +1,114 @@
+import logging
+import sys
+
+from datetime import datetime
+from typing import Optional, Tuple
+
+import dateutil.parser
+
+logger = logging.getLogger("feedgen.stdout")
+
+# Language code and text pairs in the order of the Linked Events response
+Localized = Tuple[Tuple[str, str], ...]
+
+
+def localize(value, intern: bool = False) -> Localized:
+    if not isinstance(value, dict):
+        return ()
+    return tuple(
+        (sys.intern(lang), sys.intern(text) if intern and isinstance(text, str) else text)
+        for lang, text in value.items()
+    )
+
+
+def localized(values: Localized, preferred_language: str) -> Optional[str]:
+    """The text in the preferred language or, if missing, in the first language of
+    the event. Same as get_preferred_or_first with `$.field.{lang}` and `$.field.*`."""
+    for lang, text in values:
+        if lang == preferred_language and isinstance(text, str):
+            return text.strip()
+    if values and isinstance(values[0][1], str):
+        return values[0][1].strip()
+    return None
+
+
+def first(items, key: str) -> Optional[str]:
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, dict) and key in item:
+            return item[key].strip() if isinstance(item[key], str) else None
+    return None
+
+
+def parse_time(event: dict, key: str, id: str) -> Optional[datetime]:
+    try:
+        return dateutil.parser.parse(event[key])
+    except BaseException:
+        logger.error(f"event: {id} missing {key.replace('_', ' ')}")
+        return None
+
+
+class EventRecord:
+    """The fields of a Linked Events event used in the feeds. Created right after
+    fetching so that the full event JSON can be dropped before rendering."""
+
+    __slots__ = (
+        "id",
+        "is_super_event",
+        "is_sub_event",
+        "location_id",
+        "location_name",
+        "name",
+        "short_description",
+        "info_url",
+        "provider",
+        "cost",
+        "image_url",
+        "image_name",
+        "image_alt",
+        "start_time",
+        "end_time",
+        "last_modified_time",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_json(cls, event: dict) -> "EventRecord":
+        id = event.get("id")
+        location = event.get("location") if isinstance(event.get("location"), dict) else {}
+
+        cost = None
+        for offer in event.get("offers") or []:
+            price = offer.get("price") if isinstance(offer, dict) else None
+            if isinstance(price, dict) and price:
+                value = next(iter(price.values()))
+                cost = value.strip() if isinstance(value, str) else None
+                break
+
+        return cls(
+            id=id,
+            is_super_event=event.get("super_event_type") is not None,
+            is_sub_event=event.get("super_event") is not None,
+            location_id=location.get("@id"),
+            location_name=localize(location.get("name"), intern=True),
+            name=localize(event.get("name")),
+            short_description=localize(event.get("short_description")),
+            info_url=localize(event.get("info_url")),
+            provider=localize(event.get("provider"), intern=True),
+            cost=sys.intern(cost) if cost else cost,
+            image_url=first(event.get("images"), "url"),
+            image_name=first(event.get("images"), "name"),
+            image_alt=first(event.get("images"), "alt_text"),
+            start_time=parse_time(event, "start_time", id),
+            end_time=parse_time(event, "end_time", id),
+            last_modified_time=parse_time(event, "last_modified_time", id),
+        )
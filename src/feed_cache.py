@@ -0,0 +1,167 @@
+import json
+import logging
+import time
+import zlib
+
+from typing import Optional
+
+from pymemcache.serde import FLAG_COMPRESSED
+
+logger = logging.getLogger("feedgen.stdout")
+
+GENERATION_KEY = "feed:generation"
+# [generation, publish time] pairs of the recent generations
+PUBLISHED_KEY = "feed:published"
+# Readers look up the current generation at most this often
+GENERATION_CHECK_INTERVAL_SECONDS = 1
+MAX_KEY_LENGTH = 250
+
+
+def generation_key(generation: Optional[int], key: str) -> str:
+    # Feeds written before generations were introduced have no prefix
+    return key if generation is None else f"feed:{generation}:{key}"
+
+
+def manifest_key(generation: int) -> str:
+    return f"feed:{generation}"
+
+
+class Compressed(bytes):
+    """A value compressed with zlib, e.g. in a fetcher process."""
+
+
+def compress(value: bytes, level: int) -> bytes:
+    return Compressed(zlib.compress(value, level)) if level else value
+
+
+class CacheSerde:
+    """pymemcache serde storing Compressed values with the FLAG_COMPRESSED flag and
+    decompressing them on read. Other values are stored as they are."""
+
+    def serialize(self, key, value):
+        return value, FLAG_COMPRESSED if isinstance(value, Compressed) else 0
+
+    def deserialize(self, key, value, flags):
+        return zlib.decompress(value) if flags & FLAG_COMPRESSED else value
+
+
+def loads_published(value: Optional[bytes]) -> list:
+    return json.loads(value) if value is not None else []
+
+
+class FeedCache:
+    """Reads the rendered feeds of the current generation."""
+
+    def __init__(self, client):
+        self.client = client
+        self._generation = (None, [], float("-inf"))
+
+    def _refresh(self):
+        generation, published, checked_at = self._generation
+        now = time.monotonic()
+        if now - checked_at >= GENERATION_CHECK_INTERVAL_SECONDS:
+            values = self.client.get_many([GENERATION_KEY, PUBLISHED_KEY])
+            generation = int(values[GENERATION_KEY]) if values.get(GENERATION_KEY) is not None else None
+            published = loads_published(values.get(PUBLISHED_KEY))
+            self._generation = (generation, published, now)
+        return generation, published
+
+    def generation(self) -> Optional[int]:
+        return self._refresh()[0]
+
+    def published_at(self, generation: Optional[int]) -> Optional[int]:
+        """The time the readers were switched to the generation, in whole seconds."""
+        for published_generation, published_at in self._refresh()[1]:
+            if published_generation == generation:
+                return published_at
+        return None
+
+    def generation_at(self, timestamp: float) -> Optional[int]:
+        """The generation readers got at the given time, None if it is older than the
+        recent generations. Of generations published within the same second the first
+        one is returned, so that no changes are left out."""
+        before = [(published_at, -generation) for generation, published_at in self._refresh()[1] if published_at <= timestamp]
+        return -max(before)[1] if before else None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_with_generation(key)[1]
+
+    def get_with_generation(self, key: str):
+        generation = self.generation()
+        return generation, self.client.get(generation_key(generation, key))
+
+
+class FeedCacheWriter:
+    """Collects the feeds of an update run and writes them to a new generation with
+    pipelined set_many calls. The readers are switched to the new generation only in
+    publish(), so the feeds of a run become visible at once. The publish times of the
+    generations are kept for published_history_seconds."""
+
+    def __init__(self, client, compression_level: int = 6, batch_size: int = 100, published_history_seconds: float = 72 * 3600):
+        self.client = client
+        self.compression_level = compression_level
+        self.batch_size = max(batch_size, 1)
+        self.published_history_seconds = published_history_seconds
+        previous = client.get(GENERATION_KEY)
+        self.previous = int(previous) if previous is not None else None
+        self.generation = (self.previous or 0) + 1
+        self.started_at = time.time()
+        self.keys = []
+        self._pending = {}
+
+    def add(self, values: dict):
+        """values: feed key -> rendered feed, preferably compressed with compress()."""
+        for key, value in values.items():
+            if len(generation_key(self.generation, key)) > MAX_KEY_LENGTH:
+                logger.error(f"Feed key too long for memcached, not stored: {key}")
+                continue
+            self._pending[key] = value
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def keep(self, keys: list):
+        """Copy feeds that could not be updated in this run from the previous generation."""
+        found = self.client.get_many([generation_key(self.previous, key) for key in keys])
+        self.add({
+            key: compress(found[generation_key(self.previous, key)], self.compression_level)
+            for key in keys if generation_key(self.previous, key) in found
+        })
+
+    def flush(self):
+        if not self._pending:
+            return
+        values = {generation_key(self.generation, key): value for key, value in self._pending.items()}
+        failed = self.client.set_many(values, noreply=False)
+        if failed:
+            logger.error(f"Storing {len(failed)} feeds failed, e.g. {failed[0]}")
+        self.keys += self._pending
+        self._pending = {}
+
+    def publish(self) -> bool:
+        self.flush()
+        if not self.keys:
+            logger.warning(f"No feeds were stored, kept feed generation {self.previous}")
+            return False
+        manifest = "\n".join(self.keys).encode()
+        self.client.set(manifest_key(self.generation), compress(manifest, self.compression_level), noreply=False)
+        # Whole seconds like the Last-Modified header, so that it can be used as is to ask for changes
+        published_at = int(time.time())
+        published = [
+            [generation, at] for generation, at in loads_published(self.client.get(PUBLISHED_KEY))
+            if at >= published_at - self.published_history_seconds and generation < self.generation
+        ]
+        self.client.set(PUBLISHED_KEY, json.dumps(published + [[self.generation, published_at]]), noreply=False)
+        self.client.set(GENERATION_KEY, str(self.generation), noreply=False)
+        # Readers may still use the previous generation for a moment, the one before it is removed
+        if self.previous is not None and self.previous > 1:
+            self.remove(self.previous - 1)
+        return True
+
+    def remove(self, generation: int):
+        manifest = self.client.get(manifest_key(generation))
+        if manifest is None:
+            return
+        keys = [generation_key(generation, key) for key in manifest.decode().split("\n")]
+        for i in range(0, len(keys), self.batch_size):
+            self.client.delete_many(keys[i:i + self.batch_size])
+        self.client.delete(manifest_key(generation))
@@ -0,0 +1,96 @@
+import json
+import re
+
+from typing import Optional
+
+# The rendered items, their guids and the element marking removed items. The text
+# content of the feeds is escaped, so these tags can't appear inside an item.
+ITEM_START = b"<item>"
+ITEM_END = b"</item>"
+GUID_PATTERN = re.compile(rb"<guid[^>]*>([^<]*)</guid>")
+REMOVED_CATEGORY = "removed"
+
+
+def changes_key(id: str, lang: str) -> str:
+    return f"changes:{id},{lang}"
+
+
+def split_items(xml: bytes):
+    """The rendered feed as the part before the items, (guid, item) pairs and the part after them."""
+    start = xml.find(ITEM_START)
+    if start < 0:
+        end = xml.rfind(b"</channel>")
+        return xml[:end], [], xml[end:]
+    items = []
+    end = start
+    while start >= 0:
+        end = xml.index(ITEM_END, start) + len(ITEM_END)
+        item = xml[start:end]
+        guid = GUID_PATTERN.search(item)
+        items.append((guid.group(1).decode() if guid else item.decode(), item))
+        start = xml.find(ITEM_START, end)
+    return xml[:xml.find(ITEM_START)], items, xml[end:]
+
+
+def update_history(previous: Optional[dict], xml: bytes, generation: int, now: float, retention_seconds: float) -> dict:
+    """Item history of a feed, updated with the feed rendered for the given generation.
+
+    Each item keeps the generation it was added or last changed in. Removed items are
+    kept as (guid, generation, time removed) for retention_seconds, after which the
+    changes since then are no longer complete and the horizon is moved past them.
+    Changes are stamped with generations rather than times, because a generation is
+    visible to the readers only once the whole update run has been published."""
+    head, items, tail = split_items(xml)
+    if previous is None:
+        previous = {"horizon": generation, "items": [], "removed": []}
+
+    previous_items = {guid: (item, changed_generation) for guid, item, changed_generation in previous["items"]}
+    current = []
+    for guid, item in items:
+        text = item.decode()
+        old = previous_items.pop(guid, None)
+        if old is not None and old[0] == text:
+            current.append([guid, text, old[1]])
+        else:
+            current.append([guid, text, generation])
+
+    horizon = previous["horizon"]
+    removed = []
+    current_guids = {guid for guid, *_ in current}
+    for guid, removed_generation, removed_at in previous["removed"] + [[guid, generation, now] for guid in previous_items]:
+        if guid in current_guids:
+            continue
+        if removed_at < now - retention_seconds:
+            horizon = max(horizon, removed_generation)
+            continue
+        removed.append([guid, removed_generation, removed_at])
+
+    return {"horizon": horizon, "head": head.decode(), "tail": tail.decode(), "items": current, "removed": removed}
+
+
+def dumps(history: dict) -> bytes:
+    return json.dumps(history, separators=(",", ":")).encode()
+
+
+def loads(value: Optional[bytes]) -> Optional[dict]:
+    return json.loads(value) if value is not None else None
+
+
+def render_changes(history: dict, current_generation: int, since_generation: Optional[int]):
+    """The feed with only the items added, changed or removed after the given generation,
+    and whether it is a delta at all. If the history doesn't reach back far enough the
+    whole feed is returned instead."""
+    delta = since_generation is not None and history["horizon"] <= since_generation <= current_generation
+
+    parts = [history["head"]]
+    if delta:
+        # items: [guid, item, generation], removed: [guid, generation, time]
+        parts += [item for guid, item, changed in history["items"] if changed > since_generation]
+        parts += [
+            f"<item><guid>{guid}</guid><category>{REMOVED_CATEGORY}</category></item>"
+            for guid, removed_generation, removed_at in history["removed"] if removed_generation > since_generation
+        ]
+    else:
+        parts += [item for guid, item, changed in history["items"]]
+    parts.append(history["tail"])
+    return "".join(parts).encode(), delta
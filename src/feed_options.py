@@ -0,0 +1,73 @@
+import logging
+
+from datetime import datetime, timedelta
+from typing import Optional
+
+from event_record import EventRecord
+from utils import strtobool
+
+logger = logging.getLogger("feedgen.stdout")
+
+
+class FeedOptions:
+    """Per feed event selection. The defaults come from the environment and can be
+    overridden per library with Kirkanta custom data fields."""
+
+    __slots__ = ("days", "max_items", "skip_super_events", "skip_sub_events")
+
+    # Kirkanta custom data field id -> option
+    CUSTOM_DATA_FIELDS = {
+        "le_rss_days": "days",
+        "le_rss_max_items": "max_items",
+        "le_rss_skip_super_events": "skip_super_events",
+        "le_rss_skip_sub_events": "skip_sub_events",
+    }
+    # Smallest valid value of the numeric options, max_items 0 means no limit
+    MINIMUMS = {"days": 1, "max_items": 0}
+
+    def __init__(self, days: int, max_items: int, skip_super_events: bool, skip_sub_events: bool):
+        self.days = days
+        self.max_items = max_items
+        self.skip_super_events = skip_super_events
+        self.skip_sub_events = skip_sub_events
+
+    def __eq__(self, other):
+        return isinstance(other, FeedOptions) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return "FeedOptions(" + ", ".join(f"{name}={getattr(self, name)}" for name in self.__slots__) + ")"
+
+    def with_custom_data(self, custom_data: dict) -> "FeedOptions":
+        values = {name: getattr(self, name) for name in self.__slots__}
+        for field, name in self.CUSTOM_DATA_FIELDS.items():
+            value = custom_data.get(field)
+            if value is None or str(value).strip() == "":
+                continue
+            try:
+                if name in self.MINIMUMS:
+                    number = int(value)
+                    if number < self.MINIMUMS[name]:
+                        raise ValueError(f"{name} must be at least {self.MINIMUMS[name]}")
+                    values[name] = number
+                else:
+                    values[name] = strtobool(str(value).strip(), raise_exc=True)
+            except ValueError:
+                logger.error(f"Invalid Kirkanta custom data value {field}={value}, using {values[name]}")
+        return FeedOptions(**values)
+
+    def select(self, events: list[EventRecord], window: int, now: datetime) -> list[EventRecord]:
+        """Filter and truncate events sorted by start time. window is the amount of
+        days the events were fetched for, events after this feed's window are left out."""
+        window_end: Optional[datetime] = now + timedelta(days=self.days) if self.days < window else None
+        selected = []
+        for event in events:
+            if self.skip_super_events and event.is_super_event:
+                continue
+            if self.skip_sub_events and event.is_sub_event:
+                continue
+            if window_end is not None and event.start_time is not None and event.start_time > window_end:
+                continue
+            selected.append(event)
+            if self.max_items and len(selected) >= self.max_items:
+                break
+        return selected
@@ -0,0 +1,515 @@
+"""The feed update job: fetches the places and events from Linked Events, renders the
+feeds and stores them in the cache. Run by the feed updater, see updater.py."""
+import multiprocessing
+import time
+import urllib.parse
+
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Optional
+
+from fastapi import HTTPException
+from jsonpath_ng.ext import parse
+from pebble import ProcessPool
+from pymemcache.client import base
+
+import feed_changes
+import profiling
+
+from rss_feed import (GUID, Enclosure, Image, Item, RSSFeed, EventMeta)
+from event_record import EventRecord, localized
+from feed_cache import CacheSerde, FeedCacheWriter, compress, generation_key
+from feed_options import FeedOptions
+from settings import (
+    API_CLIENT_POOL_SIZE, API_CLIENT_RETRIES, API_CLIENT_TIMEOUT_SECONDS, CACHE_TTL, CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RESET_SECONDS, CONSORTIUM_ID, EVENT_DAYS, EVENT_PAGE_SIZE, EVENT_QUERY_BATCH_SIZE, EVENT_URL_TEMPLATE,
+    FEED_BASE_URL, FEED_CACHE_COMPRESSION_LEVEL, FEED_CACHE_WRITE_BATCH_SIZE, FEED_CHANGES, FEED_CHANGES_RETENTION_HOURS,
+    FEED_LIMIT_VARIANTS, FEED_MAX_ITEMS, FEED_PROFILE_DIR, FEED_PROFILE_KEEP, FEED_PROFILE_SAMPLE_RATE, FEED_PROFILER,
+    FEED_TRACE_HISTORY, FEED_TRACING, JSON_DECODER, KIRKANTA_BASE_URL, LINKED_EVENTS_BASE_URL, LOAD_IMAGES_FROM_API,
+    MEMCACHED_SERVER, SKIP_SUB_EVENTS, SKIP_SUPER_EVENTS, SUPPORTED_LANGUAGES, UPDATER_CPU_AFFINITY, UPDATER_NICE,
+    UPSTREAM_BACKOFF_BASE_SECONDS, UPSTREAM_BACKOFF_MAX_SECONDS, UPSTREAM_BURST, UPSTREAM_MAX_CONCURRENCY_PER_HOST,
+    UPSTREAM_RATE_LIMIT, UPSTREAM_REQUEST_TIMEOUT_SECONDS, UPSTREAM_SLOT_TIMEOUT_SECONDS, logger,
+)
+from update_process import apply_priority
+from upstream import UpstreamClient, UpstreamError, UpstreamGuard, UpstreamUnavailable, install_guard
+
+memcached_client = base.Client(MEMCACHED_SERVER, serde=CacheSerde())
+
+profiling.configure(
+    store=memcached_client,
+    enabled=FEED_TRACING,
+    history=FEED_TRACE_HISTORY,
+    sample_rate=FEED_PROFILE_SAMPLE_RATE,
+    profiler=FEED_PROFILER,
+    profile_dir=FEED_PROFILE_DIR,
+    profile_keep=FEED_PROFILE_KEEP,
+)
+
+
+def create_upstream_guard():
+    return UpstreamGuard(
+        rate=UPSTREAM_RATE_LIMIT,
+        burst=UPSTREAM_BURST,
+        hosts=[LINKED_EVENTS_BASE_URL, KIRKANTA_BASE_URL],
+        max_concurrency_per_host=UPSTREAM_MAX_CONCURRENCY_PER_HOST,
+        failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_seconds=CIRCUIT_BREAKER_RESET_SECONDS,
+        # The slot of a killed fetcher process is freed once its lease is no longer renewed
+        lease_seconds=UPSTREAM_REQUEST_TIMEOUT_SECONDS,
+        # Fetcher processes are killed after API_CLIENT_TIMEOUT_SECONDS anyway
+        slot_timeout=min(UPSTREAM_SLOT_TIMEOUT_SECONDS, API_CLIENT_TIMEOUT_SECONDS),
+    )
+
+
+DEFAULT_FEED_OPTIONS = FeedOptions(
+    days=EVENT_DAYS,
+    max_items=FEED_MAX_ITEMS,
+    skip_super_events=bool(SKIP_SUPER_EVENTS),
+    skip_sub_events=bool(SKIP_SUB_EVENTS),
+)
+
+
+http_client = UpstreamClient(
+    guard_factory=create_upstream_guard,
+    retries=API_CLIENT_RETRIES,
+    backoff_base_seconds=UPSTREAM_BACKOFF_BASE_SECONDS,
+    backoff_max_seconds=UPSTREAM_BACKOFF_MAX_SECONDS,
+    json_decoder=JSON_DECODER,
+    timeout=UPSTREAM_REQUEST_TIMEOUT_SECONDS,
+)
+
+
+def init_fetcher_process(guard: UpstreamGuard):
+    install_guard(guard)
+    # Don't share the memcached socket inherited from the parent process
+    memcached_client.close()
+
+
+def render_feed(feed: RSSFeed) -> bytes:
+    with profiling.stage("to_xml"):
+        return feed.to_xml(
+            pretty_print=False,
+            encoding="UTF-8",
+            standalone=True,
+            skip_empty=True
+        )
+
+
+def build_feed(
+    id: str, lang: str, places: dict, events: list[EventRecord], generation: int, previous_generation: Optional[int], now: float
+) -> Optional[dict]:
+    """Returns the compressed feed, its truncated variants and its item history by cache key, None on error."""
+    try:
+        with profiling.build(f"{id},{lang}"):
+            feed = create_feed_for_location(f"{id}", places, events, lang)
+            xml = render_feed(feed)
+            profiling.count("bytes", len(xml))
+
+            # Truncated variants for the /events limit parameter
+            values = {f"{id},{lang}": xml}
+            items = feed.content.item
+            for limit in FEED_LIMIT_VARIANTS:
+                if limit < len(items):
+                    feed.content.item = items[:limit]
+                    values[f"{id},{lang},{limit}"] = render_feed(feed)
+                else:
+                    values[f"{id},{lang},{limit}"] = xml
+
+            if FEED_CHANGES:
+                with profiling.stage("changes"):
+                    values[feed_changes.changes_key(id, lang)] = feed_changes.dumps(feed_changes.update_history(
+                        read_history(id, lang, previous_generation), xml, generation, now, FEED_CHANGES_RETENTION_HOURS * 3600
+                    ))
+
+            with profiling.stage("compress"):
+                values = {key: compress(value, FEED_CACHE_COMPRESSION_LEVEL) for key, value in values.items()}
+            profiling.count("compressed_bytes", len(values[f"{id},{lang}"]))
+        logger.debug(f"Updated {id}, lang {lang}")
+        return values
+    except UpstreamUnavailable:
+        logger.warning(f"Linked Events unavailable, kept previous feed for {id}, lang {lang}")
+    except BaseException as e:
+        logger.error(f"Data fetch error for {id}, lang {lang}: {e}")
+    return None
+
+
+def read_history(id: str, lang: str, generation: Optional[int]) -> Optional[dict]:
+    if generation is None:
+        return None
+    try:
+        return feed_changes.loads(memcached_client.get(generation_key(generation, feed_changes.changes_key(id, lang))))
+    except BaseException as e:
+        logger.error(f"Reading the item history of {id}, lang {lang} failed, starting a new one: {e}")
+        return None
+
+
+def feed_keys(id: str, lang: str) -> list:
+    keys = [f"{id},{lang}"] + [f"{id},{lang},{limit}" for limit in FEED_LIMIT_VARIANTS]
+    return keys + [feed_changes.changes_key(id, lang)] if FEED_CHANGES else keys
+
+
+def batch_name(place_ids: list):
+    return f"batch:{place_ids[0]}+{len(place_ids) - 1}"
+
+
+def fetch_places_and_events(place_ids: list, days: int):
+    with profiling.build(batch_name(place_ids)):
+        places = {}
+        with profiling.stage("places"):
+            for place_id in place_ids:
+                try:
+                    resp = http_client.get(f'{LINKED_EVENTS_BASE_URL}/place/{place_id}/')
+                except UpstreamUnavailable:
+                    raise
+                except UpstreamError as e:
+                    # Only the feeds listing this place are kept, not all feeds of the batch
+                    logger.error(f"Place fetch error for {place_id}: {e}")
+                    continue
+                if resp.status_code != 200:
+                    logger.error(f"Place not found: {place_id}")
+                    continue
+                places[place_id] = http_client.json(resp)
+        profiling.count("places", len(places))
+        if not places:
+            return places, []
+        return places, fetch_events(",".join(places), days)
+
+
+def feed_result(future, id: str, lang: str) -> Optional[dict]:
+    try:
+        return future.result()
+    except TimeoutError:
+        logger.error(f"Feed generation timeout: {id}, lang {lang}")
+        profiling.timed_out(f"{id},{lang}")
+        future.cancel()
+    except Exception as error:
+        logger.error(error)
+    return None
+
+
+def plan_batches(feeds: dict):
+    """Each place is fetched only once per run regardless of how many feeds it is listed in,
+    for the longest event window of those feeds."""
+    place_windows = {}
+    for id, options in feeds.items():
+        for place_id in id.split(","):
+            place_windows[place_id] = max(place_windows.get(place_id, 0), options.days)
+    batches = []
+    for days in sorted(set(place_windows.values())):
+        place_ids = sorted(place_id for place_id, window in place_windows.items() if window == days)
+        batches += [(place_ids[i:i + EVENT_QUERY_BATCH_SIZE], days) for i in range(0, len(place_ids), EVENT_QUERY_BATCH_SIZE)]
+    return place_windows, batches
+
+
+def populate_cache():
+    start_time = time.time()
+    logger.info("Started feed update job.")
+    apply_priority(UPDATER_NICE, UPDATER_CPU_AFFINITY)
+
+    # One guard per run, shared by this process and all fetcher processes
+    guard = create_upstream_guard()
+    install_guard(guard)
+
+    libraries = http_client.json(http_client.get(
+        '{KIRKANTA_BASE_URL}/library?consortium={consortium}&with=customData'.format(
+            KIRKANTA_BASE_URL=KIRKANTA_BASE_URL,
+            consortium=CONSORTIUM_ID)
+        ))
+
+    total = int(parse('$.total').find(libraries)[0].value)
+    parsed = 0
+
+    feeds = {}
+    add_feed_configurations(libraries, feeds)
+
+    while parsed < total:
+        libraries = http_client.json(http_client.get(
+            '{KIRKANTA_BASE_URL}/library?consortium={consortium}&with=customData&skip={skip}'.format(
+                KIRKANTA_BASE_URL=KIRKANTA_BASE_URL,
+                consortium=CONSORTIUM_ID,
+                skip=parsed)
+        ))
+        parsed += len([id.value for id in parse("$.items[*]").find(libraries)])
+        add_feed_configurations(libraries, feeds)
+
+    place_windows, batches = plan_batches(feeds)
+
+    logger.info(
+        f"Updating {len(feeds)} unique location feeds ({len(place_windows)} places in {len(batches)} batches)"
+    )
+
+    # The guard's shared memory and lock file are inherited by forking, other start methods can't pass them
+    with ProcessPool(
+        max_workers=API_CLIENT_POOL_SIZE, initializer=init_fetcher_process, initargs=(guard,),
+        context=multiprocessing.get_context("fork")
+    ) as fetcher_pool:
+        batch_futures = [
+            fetcher_pool.schedule(fetch_places_and_events, args=(batch, days), timeout=API_CLIENT_TIMEOUT_SECONDS)
+            for batch, days in batches
+        ]
+
+        places = {}
+        events_by_location = {}
+        for (batch, days), future in zip(batches, batch_futures):
+            try:
+                batch_places, batch_events = future.result()
+            except TimeoutError:
+                logger.error(f"Event fetch timeout for places {','.join(batch)}")
+                profiling.timed_out(batch_name(batch))
+                continue
+            except Exception as error:
+                logger.error(f"Event fetch error for places {','.join(batch)}: {error}")
+                continue
+            places.update(batch_places)
+            for event in batch_events:
+                events_by_location.setdefault(event.location_id, []).append(event)
+
+        writer = FeedCacheWriter(
+            memcached_client, FEED_CACHE_COMPRESSION_LEVEL, FEED_CACHE_WRITE_BATCH_SIZE, FEED_CHANGES_RETENTION_HOURS * 3600
+        )
+        builds = schedule_feed_builds(fetcher_pool, feeds, place_windows, places, events_by_location, writer)
+        for (id, lang), future in builds:
+            values = feed_result(future, id, lang)
+            if values is None:
+                writer.keep(feed_keys(id, lang))
+            else:
+                writer.add(values)
+        if writer.publish():
+            logger.info(f"Stored {len(writer.keys)} cache entries in feed generation {writer.generation}")
+
+    if guard.is_open():
+        logger.error("Feed update job stopped early, Linked Events is unavailable. Previous feeds were kept.")
+    logger.info(f"Completed feed update job in {time.time() - start_time} seconds.")
+
+
+def schedule_feed_builds(fetcher_pool, feeds: dict, place_windows: dict, places: dict, events_by_location: dict, writer):
+    now = aware_utcnow()
+    builds = []
+    for id, options in feeds.items():
+        feed_place_ids = id.split(",")
+        missing = [place_id for place_id in feed_place_ids if place_id not in places]
+        if missing:
+            logger.error(f"Data fetch error for {id}, kept previous feeds. Missing places: {','.join(missing)}")
+            for lang in SUPPORTED_LANGUAGES:
+                writer.keep(feed_keys(id, lang))
+            continue
+        feed_places = {place_id: places[place_id] for place_id in feed_place_ids}
+        feed_events = sorted(
+            [event for place in feed_places.values() for event in events_by_location.get(place.get("@id"), [])],
+            key=lambda event: event.start_time.timestamp() if event.start_time else float("inf")
+        )
+        feed_events = options.select(
+            feed_events,
+            window=max(place_windows[place_id] for place_id in feed_place_ids),
+            now=now
+        )
+        for lang in SUPPORTED_LANGUAGES:
+            future = fetcher_pool.schedule(
+                build_feed,
+                kwargs={
+                    "id": id, "lang": lang, "places": feed_places, "events": feed_events,
+                    "generation": writer.generation, "previous_generation": writer.previous, "now": writer.started_at
+                },
+                timeout=API_CLIENT_TIMEOUT_SECONDS
+            )
+            builds.append(((id, lang), future))
+    return builds
+
+
+def add_feed_configurations(libraries, feeds: dict):
+    for library in parse('$.items[*]').find(libraries):
+        custom_data = {data.get("id"): data.get("value") for data in library.value.get("customData") or []}
+        id = custom_data.get("le_rss_locations")
+        if not id:
+            continue
+        options = DEFAULT_FEED_OPTIONS.with_custom_data(custom_data)
+        if id not in feeds:
+            feeds[id] = options
+        elif feeds[id] != options:
+            logger.warning(f"Conflicting feed options for {id}, using {feeds[id]} instead of {options}")
+
+
+def get_preferred_or_first(root, pathOfPreferred, pathOfFirst):
+    try:
+        try:
+            value = parse(pathOfPreferred).find(root)[0].value.strip()
+        except BaseException:
+            value = parse(pathOfFirst).find(root)[0].value.strip()
+    except BaseException:
+        value = None
+    return value
+
+
+def aware_utcnow():
+    """to be used instead of datetime.utcnow() in Python >= 3.12"""
+    return datetime.now(timezone.utc)
+
+
+def get_locations(location_string, places, preferred_language):
+    locations = {}
+    for loc in location_string.split(","):
+        try:
+            place = places[loc]
+            aid = get_preferred_or_first(place, '$.@id', '$.@id')
+            name = get_preferred_or_first(place, f'$.name.{preferred_language}', '$.name.*')
+            street_address = get_preferred_or_first(place, f'$.street_address.{preferred_language}', '$.street_address.*')
+            locality = get_preferred_or_first(place, f'$.address_locality.{preferred_language}', '$.address_locality.*')
+            email = get_preferred_or_first(place, '$.email', '$.email')
+            info_url = get_preferred_or_first(place, f'$.info_url.{preferred_language}', '$.info_url.*')
+            locations[aid] = dict(name=name, street_address=street_address, locality=locality, email=email, info_url=info_url)
+        except BaseException:
+            raise HTTPException(status_code=404, detail=f"Place not found: {loc}")
+    return locations
+
+
+def parse_to_itemlist(events: list[EventRecord], preferred_language, locations):
+    items = []
+    fetch_image_data = LOAD_IMAGES_FROM_API
+    if fetch_image_data:
+        # Pillow is only needed for the image dimensions
+        import PIL.Image
+    for event in events:
+        id = event.id
+
+        imageUrl = event.image_url
+        if imageUrl is not None:
+            try:
+                if fetch_image_data:
+                    with profiling.stage("parse.images"):
+                        image_raw = http_client.get(imageUrl)
+                        if image_raw.status_code != 200:
+                            raise HTTPException(status_code=404, detail=f"Image not found: {imageUrl}")
+                        length = image_raw.num_bytes_downloaded
+                        loaded_image = PIL.Image.open(BytesIO(image_raw.content))
+                        width, height = loaded_image.size
+                        type = f"image/{loaded_image.format.lower()}"
+                    profiling.count("images")
+                else:
+                    length = 0
+                    width = 0
+                    height = 0
+                    type = "image"
+                enclosure = Enclosure(url=imageUrl, length=length, type=type)
+                image = Image(url=imageUrl, title=event.image_name, link=imageUrl, description=event.image_alt, width=width, height=height)
+            except UpstreamUnavailable:
+                raise
+            except BaseException:
+                enclosure = None
+                image = None
+        else:
+            enclosure = None
+            image = None
+
+        location = locations[event.location_id]
+
+        if EVENT_URL_TEMPLATE is not None:
+            eventUrl = EVENT_URL_TEMPLATE.format(id=id)
+        else:
+            eventUrl = localized(event.info_url, preferred_language)
+            if eventUrl is None or eventUrl == "":
+                eventUrl = location.get("info_url")
+
+        title = localized(event.name, preferred_language)
+        description = localized(event.short_description, preferred_language)
+
+        organizer = localized(event.provider, preferred_language)
+        if organizer is None or organizer == "":
+            organizer = localized(event.location_name, preferred_language)
+
+        items.append(
+            Item(
+                title=title,
+                link=eventUrl,
+                description=description,
+                author=location.get("email"),
+                enclosure=enclosure,
+                guid=GUID(content=f'{LINKED_EVENTS_BASE_URL}/event/{id}', is_permalink=None),
+                pub_date=event.last_modified_time,
+                xcal_title=title,
+                xcal_featured=image,
+                xcal_dtstart=event.start_time,
+                xcal_dtend=event.end_time,
+                xcal_content=description,
+                xcal_organizer=organizer,
+                xcal_location=location.get("name"),
+                xcal_location_address=location.get("street_address"),
+                xcal_location_city=location.get("locality"),
+                xcal_url=eventUrl,
+                xcal_cost=event.cost,
+                event_location=location.get("name"),
+                event_location_address=location.get("street_address"),
+                event_location_city=location.get("locality"),
+                event_organizer=organizer,
+                event_organizer_url=eventUrl,
+                event_cost=event.cost,
+                event_meta=EventMeta(dtstart=event.start_time, dtend=event.end_time)
+            )
+        )
+    profiling.count("items", len(items))
+    return items
+
+
+def fetch_events(location_string, days: int = EVENT_DAYS):
+    events = []
+    page_number = 1
+    next = True
+
+    while next:
+        apiurl = f"{LINKED_EVENTS_BASE_URL}/event/?location={location_string}&days={days}&sort=start_time&page={page_number}"
+        if EVENT_PAGE_SIZE:
+            apiurl += f"&page_size={EVENT_PAGE_SIZE}"
+        with profiling.stage("event_pages"):
+            response = http_client.get(apiurl)
+        profiling.count("event_pages")
+        try:
+            with profiling.stage("json"):
+                page = http_client.json(response)
+            # Only the compact records are kept, the page JSON is dropped right away
+            events += [EventRecord.from_json(data.value) for data in parse('$.data[*]').find(page)]
+        except BaseException:
+            # A partial result would replace complete feeds in the cache
+            raise UpstreamError(f"LinkedEvents API event list parsing failed for: {apiurl}")
+        try:
+            next_page = parse('$.meta.next').find(page)[0].value
+        except BaseException:
+            logger.error(f"LinkedEvents API didn't return next_page: {apiurl}")
+            next_page = None
+        del page, response
+
+        if next_page is None:
+            next = False
+        else:
+            try:
+                next_page_url = urllib.parse.urlparse(next_page, allow_fragments=False).query
+                page_number = int(urllib.parse.parse_qs(next_page_url)["page"][0])
+                next = True
+            except BaseException:
+                logger.error("Couldn't parse next page number.from Linked Events response.")
+                next = False
+
+    profiling.count("events", len(events))
+    return events
+
+
+def create_feed_for_location(
+    location_string, places: dict, events: list, preferred_language: str = 'fi'
+):
+    with profiling.stage("locations"):
+        locations = get_locations(location_string=location_string, places=places, preferred_language=preferred_language)
+    with profiling.stage("parse"):
+        items = parse_to_itemlist(events, preferred_language, locations)
+
+    channel = {
+        'title': ", ".join([value.get("name") for key, value in locations.items() if value.get("name")]),
+        'link':
+            f'{FEED_BASE_URL}/events?location={location_string}' +
+            f'&preferred_language={preferred_language}',
+        'description': ", ".join([value.get("name") for key, value in locations.items() if value.get("name")]),
+        'language': '',
+        'pub_date': aware_utcnow(),
+        'last_build_date': aware_utcnow(),
+        'ttl': CACHE_TTL,
+        'item': items,
+    }
+    with profiling.stage("model"):
+        return RSSFeed(content=channel)
@@ -0,0 +1,240 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import time
+
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger("feedgen.stdout")
+
+TRACE_SEQUENCE_KEY = "trace:seq"
+# Build traces are published at most this often while a build is running
+CHECKPOINT_INTERVAL_SECONDS = 1
+
+
+class ProfilingSettings:
+    def __init__(
+        self,
+        store=None,
+        enabled: bool = False,
+        history: int = 200,
+        sample_rate: float = 0,
+        profiler: str = "cprofile",
+        profile_dir: str = "/tmp/feed-profiles",
+        profile_keep: int = 10,
+    ):
+        self.store = store
+        self.enabled = enabled
+        self.history = max(history, 1)
+        self.sample_rate = sample_rate
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.profile_keep = profile_keep
+
+
+settings = ProfilingSettings()
+_current: Optional["BuildTrace"] = None
+
+
+def configure(**kwargs):
+    global settings
+    settings = ProfilingSettings(**kwargs)
+
+
+def slot_key(slot: int) -> str:
+    return f"trace:{slot % settings.history}"
+
+
+def build_key(name: str) -> str:
+    return f"trace:build:{name}"
+
+
+class BuildTrace:
+    """Stage timings (seconds, nested stages are included in their parent) and counts
+    of a single feed build or event fetch batch. Stored in the cache so that the
+    traces of killed builds and of other processes are available, too.
+
+    The stages that are running are kept as (stage, start time) pairs. Entering a
+    stage is published unless the stored trace already shows that stage running, so
+    the stage a killed build was stuck in is always stored. Its start time may then
+    be that of an earlier run of the same stage, at most CHECKPOINT_INTERVAL_SECONDS
+    before."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.status = "running"
+        self.error = None
+        self.duration = None
+        self.stages = {}
+        self.counts = {}
+        self.running = []
+        self.slot = None
+        self._published_at = 0
+        self._published_running = ()
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "status": self.status,
+            "error": self.error,
+            "duration": self.duration if self.duration is not None else time.time() - self.started_at,
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            "counts": self.counts,
+            "running": [[stage, started_at] for stage, started_at in self.running],
+        }
+
+    def publish(self):
+        if settings.store is None:
+            return
+        try:
+            if self.slot is None:
+                settings.store.add(TRACE_SEQUENCE_KEY, "0", noreply=False)
+                self.slot = settings.store.incr(TRACE_SEQUENCE_KEY, 1)
+                settings.store.set(build_key(self.name), str(self.slot))
+            settings.store.set(slot_key(self.slot), json.dumps(self.as_dict()))
+            self._published_at = time.monotonic()
+            self._published_running = tuple(stage for stage, _ in self.running)
+        except BaseException as e:
+            logger.debug(f"Build trace publishing failed for {self.name}: {e}")
+
+    def checkpoint(self):
+        if time.monotonic() - self._published_at >= CHECKPOINT_INTERVAL_SECONDS:
+            self.publish()
+
+    def enter(self, stage: str):
+        self.running.append((stage, time.time()))
+        if stage not in self._published_running:
+            self.publish()
+        else:
+            self.checkpoint()
+
+    def exit(self, stage: str, seconds: float):
+        self.running.pop()
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+        self.checkpoint()
+
+
+@contextmanager
+def stage(name: str):
+    trace = _current
+    if trace is None:
+        yield
+        return
+    trace.enter(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.exit(name, time.perf_counter() - start)
+
+
+def count(name: str, amount: int = 1):
+    if _current is not None:
+        _current.counts[name] = _current.counts.get(name, 0) + amount
+
+
+def _start_profiler():
+    if settings.profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, using cProfile instead")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _save_profile(profiler, trace: BuildTrace):
+    """Store the profile and keep only the profile_keep slowest ones. The file names
+    start with the build duration so that the slowest builds sort last."""
+    os.makedirs(settings.profile_dir, exist_ok=True)
+    name = "".join(c if c.isalnum() else "_" for c in trace.name)
+    prefix = os.path.join(settings.profile_dir, f"{int(trace.duration * 1000):010d}-{name}-{os.getpid()}")
+    if isinstance(profiler, cProfile.Profile):
+        profiler.dump_stats(f"{prefix}.prof")
+    else:
+        with open(f"{prefix}.html", "w") as f:
+            f.write(profiler.output_html())
+
+    profiles = sorted(os.listdir(settings.profile_dir))
+    for old in profiles[:max(len(profiles) - settings.profile_keep, 0)]:
+        try:
+            os.remove(os.path.join(settings.profile_dir, old))
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def build(name: str):
+    global _current
+    if not settings.enabled:
+        yield None
+        return
+
+    trace = BuildTrace(name)
+    trace.publish()
+    profiler = _start_profiler() if random.random() < settings.sample_rate else None
+    _current = trace
+    start = time.perf_counter()
+    try:
+        yield trace
+        trace.status = "ok"
+    except BaseException as e:
+        trace.status = "error"
+        trace.error = str(e)
+        raise
+    finally:
+        trace.duration = time.perf_counter() - start
+        _current = None
+        trace.publish()
+        if profiler is not None:
+            if isinstance(profiler, cProfile.Profile):
+                profiler.disable()
+            else:
+                profiler.stop()
+            try:
+                _save_profile(profiler, trace)
+            except BaseException as e:
+                logger.error(f"Saving profile failed for {name}: {e}")
+
+
+def timed_out(name: str):
+    """Mark the trace of a build killed by the pool timeout and log where the time went."""
+    if not settings.enabled or settings.store is None:
+        return
+    try:
+        slot = settings.store.get(build_key(name))
+        data = settings.store.get(slot_key(int(slot))) if slot is not None else None
+        if data is None:
+            return
+        trace = json.loads(data)
+        trace["status"] = "timeout"
+        settings.store.set(slot_key(int(slot)), json.dumps(trace))
+        now = time.time()
+        running = " > ".join(f"{stage} ({now - started_at:.1f}s)" for stage, started_at in trace.get("running", [])) or "none"
+        logger.error(
+            f"Build trace for {name} at timeout: running {running}, stages {trace['stages']}, counts {trace['counts']}"
+        )
+    except BaseException as e:
+        logger.debug(f"Reading build trace failed for {name}: {e}")
+
+
+def recent_traces(limit: int) -> list:
+    if settings.store is None:
+        return []
+    seq = settings.store.get(TRACE_SEQUENCE_KEY)
+    if seq is None:
+        return []
+    last = int(seq)
+    slots = range(last, max(last - min(limit, settings.history), 0), -1)
+    found = settings.store.get_many([slot_key(slot) for slot in slots])
+    return [json.loads(found[slot_key(slot)]) for slot in slots if slot_key(slot) in found]
@@ -1,4 +1,13 @@
 # flake8: noqa
+import importlib
 
-from .models import *
 from .rss_response import RSSResponse
+
+
+def __getattr__(name):
+    # Building the pydantic_xml models is slow, they are imported only when used
+    models = importlib.import_module(".models", __name__)
+    try:
+        return getattr(models, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
@@ -26,7 +26,9 @@ class XCalCategories(BaseXmlModel):
 class EventMeta(BaseXmlModel):
     # FIXME: The timestamp format is non-standard so that also the time part would be supported by Finna
     @field_serializer("dtstart", "dtend")
-    def convert_timestamp(dt: datetime) -> str:
+    def convert_timestamp(dt: Optional[datetime]) -> Optional[str]:
+        if dt is None:
+            return None
         local_dt = dt.replace(tzinfo=pytz.utc).astimezone(local_tz)
         return local_dt.strftime("%Y-%m-%d%Z%H:%M:%S")
 
@@ -40,7 +42,9 @@ class EventMeta(BaseXmlModel):
 
 class Item(BaseXmlModel):
     @field_serializer("pub_date")
-    def convert_datetime_to_RFC_822(dt: datetime) -> str:
+    def convert_datetime_to_RFC_822(dt: Optional[datetime]) -> Optional[str]:
+        if dt is None:
+            return None
         dt.replace(tzinfo=timezone.utc)
         dt.replace(tzinfo=timezone.utc)
         local_dt = dt.replace(tzinfo=pytz.utc).astimezone(local_tz)
@@ -64,7 +68,9 @@ class Item(BaseXmlModel):
     # FIXME: The timestamp format is non-standard so that also the time part would be supported by Finna
 
     @field_serializer("xcal_dtstart", "xcal_dtend")
-    def convert_timestamp(dt: datetime) -> str:
+    def convert_timestamp(dt: Optional[datetime]) -> Optional[str]:
+        if dt is None:
+            return None
         local_dt = dt.replace(tzinfo=pytz.utc).astimezone(local_tz)
         return local_dt.strftime("%Y-%m-%d%Z%H:%M:%S")
 
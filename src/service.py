@@ -0,0 +1,214 @@
+"""The web service. Serves the feeds stored in the cache by the feed updater, so only
+the cache client and RSSResponse are needed here. The feed update code and its
+dependencies are imported only in the worker that runs the updates."""
+import hmac
+import os
+
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Annotated, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from pymemcache.client import base
+
+import feed_changes
+import profiling
+
+from rss_feed import RSSResponse
+from feed_cache import CacheSerde, FeedCache
+from settings import (
+    CACHE_TTL, FEED_CACHE_POOL_SIZE, FEED_CACHE_TIMEOUT_SECONDS, FEED_CHANGES, FEED_LIMIT_VARIANTS, FEED_TRACE_HISTORY,
+    FEED_TRACES_TOKEN, FEED_TRACING, FEED_UPDATER, MEMCACHED_SERVER, UPDATER_LOCK_FILE, init_sentry, logger,
+)
+from update_process import acquire_updater_lock
+
+init_sentry()
+
+# Feeds are read in the threadpool of the request handlers, one connection per thread
+feed_cache = FeedCache(base.PooledClient(
+    MEMCACHED_SERVER,
+    serde=CacheSerde(),
+    max_pool_size=FEED_CACHE_POOL_SIZE,
+    connect_timeout=FEED_CACHE_TIMEOUT_SECONDS,
+    timeout=FEED_CACHE_TIMEOUT_SECONDS,
+    no_delay=True,
+))
+
+# Only for reading the build traces, the feeds are written by the feed updater
+memcached_client = base.Client(MEMCACHED_SERVER, serde=CacheSerde())
+
+profiling.configure(store=memcached_client, enabled=FEED_TRACING, history=FEED_TRACE_HISTORY)
+
+
+scheduler = None
+updater_lock = None
+
+
+def create_scheduler():
+    # APScheduler is only needed when the feeds are updated in a uvicorn worker
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.jobstores.memory import MemoryJobStore
+    from apscheduler.executors.pool import ProcessPoolExecutor, ThreadPoolExecutor
+
+    return BackgroundScheduler(
+        jobstores={'default': MemoryJobStore()},
+        executors={'default': ProcessPoolExecutor(2), 'threadpool': ThreadPoolExecutor(1)},
+        job_defaults={'coalesce': True, 'max_instances': 1}
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global scheduler
+    # With FEED_UPDATER=process the feeds are updated by updater.py instead
+    if FEED_UPDATER == "embedded":
+        scheduler = create_scheduler()
+        scheduler.add_job(
+            claim_feed_updates, 'interval', id='claim_feed_updates', executor='threadpool',
+            seconds=60, next_run_time=datetime.now()
+        )
+        scheduler.start()
+    yield
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown(wait=False)
+
+
+def claim_feed_updates():
+    """Only the uvicorn worker holding the updater lock runs the feed updates. The
+    other workers retry periodically and take over if the holder exits."""
+    global updater_lock
+    updater_lock = acquire_updater_lock(UPDATER_LOCK_FILE)
+    if updater_lock is None:
+        return
+    logger.info("Feed updates run in this worker process")
+    from feed_update import populate_cache
+
+    scheduler.remove_job('claim_feed_updates')
+    scheduler.add_job(
+        populate_cache, 'interval', id='populate_cache', replace_existing=True,
+        seconds=CACHE_TTL, next_run_time=datetime.now(), misfire_grace_time=None
+    )
+
+
+app = FastAPI(
+    title=os.environ.get("APP_TITLE"),
+    description=os.environ.get("APP_DESCRIPTION"),
+    version=os.environ.get("APP_VERSION"),
+    contact={
+        "name": os.environ.get("APP_CONTACT_NAME"),
+        "url": os.environ.get("APP_CONTACT_URL"),
+    },
+    license_info={
+        "name": os.environ.get("APP_LICENSE_NAME"),
+        "url": os.environ.get("APP_LICENSE_URL"),
+    },
+    lifespan=lifespan
+ )
+
+
+@app.get("/status", tags=["status"])
+def get_status():
+    return {"status": "OK"}
+
+
+@app.get("/readiness", tags=["readiness"])
+async def get_readiness():
+    return Response(status_code=200)
+
+
+@app.get("/healthz", tags=["healthz"])
+async def get_healthz():
+    return Response(status_code=200)
+
+
+@app.get("/events", tags=["events"])
+async def get_events(
+    location:  Annotated[str, Query(pattern='^[a-z]*:[0-9]+(,[a-z]*:[0-9]+)*$')],
+    preferred_language: Annotated[str, Query(pattern='^fi|sv|en$')],
+    limit: Annotated[Optional[int], Query(ge=1)] = None
+):
+    if limit is not None and limit not in FEED_LIMIT_VARIANTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Supported limit values: {', '.join(str(limit) for limit in FEED_LIMIT_VARIANTS) or 'none'}"
+        )
+    try:
+        key = f"{location},{preferred_language}" if limit is None else f"{location},{preferred_language},{limit}"
+        return await run_in_threadpool(get_feed, key)
+    except BaseException:
+        raise HTTPException(status_code=404, detail="Feed not found")
+
+
+def generation_headers(generation: Optional[int]) -> dict:
+    """The generation and its publish time, for asking /events/changes for the changes since this response."""
+    if generation is None:
+        return {}
+    headers = {"X-Feed-Generation": str(generation)}
+    published_at = feed_cache.published_at(generation)
+    if published_at is not None:
+        headers["Last-Modified"] = formatdate(published_at, usegmt=True)
+    return headers
+
+
+def get_feed(key: str):
+    generation, xml = feed_cache.get_with_generation(key)
+    return RSSResponse(xml, headers=generation_headers(generation))
+
+
+def get_feed_changes(key: str, since_generation: Optional[int], since_time: Optional[float]):
+    generation, history = feed_cache.get_with_generation(key)
+    if history is None:
+        return None
+    if since_time is not None:
+        # Changes are stamped with the generation that made them visible, not with the time they were built
+        since_generation = feed_cache.generation_at(since_time)
+    xml, delta = feed_changes.render_changes(feed_changes.loads(history), generation, since_generation)
+    return RSSResponse(xml, headers={**generation_headers(generation), "X-Feed-Changes": "delta" if delta else "full"})
+
+
+@app.get("/events/changes", tags=["events"])
+async def get_event_changes(
+    location:  Annotated[str, Query(pattern='^[a-z]*:[0-9]+(,[a-z]*:[0-9]+)*$')],
+    preferred_language: Annotated[str, Query(pattern='^fi|sv|en$')],
+    since: Optional[str] = None,
+    if_modified_since: Annotated[Optional[str], Header()] = None
+):
+    if not FEED_CHANGES:
+        raise HTTPException(status_code=404, detail="Feed changes are not enabled")
+    since_generation = since_time = None
+    try:
+        if since is not None and since.isdigit():
+            since_generation = int(since)
+        elif since is not None:
+            since_datetime = datetime.fromisoformat(since)
+            since_time = (since_datetime if since_datetime.tzinfo else since_datetime.replace(tzinfo=timezone.utc)).timestamp()
+        elif if_modified_since is not None:
+            since_time = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="since must be a feed generation or an ISO 8601 timestamp")
+    if since_generation is None and since_time is None:
+        raise HTTPException(status_code=400, detail="since or If-Modified-Since is required")
+
+    response = await run_in_threadpool(
+        get_feed_changes, feed_changes.changes_key(location, preferred_language), since_generation, since_time
+    )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Feed not found")
+    return response
+
+
+@app.get("/admin/traces", tags=["admin"])
+async def get_build_traces(
+    limit: Annotated[int, Query(ge=1, le=1000)] = 50,
+    authorization: Annotated[Optional[str], Header()] = None,
+):
+    if not FEED_TRACING or not FEED_TRACES_TOKEN:
+        raise HTTPException(status_code=404, detail="Feed build tracing is not enabled")
+    if not hmac.compare_digest((authorization or "").encode(), f"Bearer {FEED_TRACES_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return await run_in_threadpool(profiling.recent_traces, limit)
+    except BaseException:
+        raise HTTPException(status_code=503, detail="Build traces not available")
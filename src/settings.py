@@ -0,0 +1,99 @@
+"""Settings from the environment and the .env file. Imported by the service, the feed
+updater and the fetcher processes, so only light modules are imported here."""
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from utils import strtobool
+
+load_dotenv()
+
+
+def at_least(name: str, value: int, minimum: int) -> int:
+    """Fail at startup on values the feed updates and the service can't use."""
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}, got {value}")
+    return value
+
+
+FEED_BASE_URL = os.getenv("FEED_BASE_URL")
+LINKED_EVENTS_BASE_URL = os.getenv("LINKED_EVENTS_BASE_URL")
+EVENT_URL_TEMPLATE = os.getenv("EVENT_URL_TEMPLATE")
+CACHE_TTL = int(os.getenv("CACHE_TTL"))
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE"))
+UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS"))
+KIRKANTA_BASE_URL = os.getenv("KIRKANTA_BASE_URL")
+CONSORTIUM_ID = int(os.getenv("CONSORTIUM_ID"))
+API_CLIENT_POOL_SIZE = int(os.getenv("API_CLIENT_POOL_SIZE"))
+API_CLIENT_TIMEOUT_SECONDS = int(os.getenv("API_CLIENT_TIMEOUT_SECONDS", default=1))
+API_CLIENT_RETRIES = int(os.getenv("API_CLIENT_RETRIES", default=3))
+LOAD_IMAGES_FROM_API = strtobool(os.getenv("LOAD_IMAGES_FROM_API"))
+SKIP_SUPER_EVENTS = strtobool(os.getenv("SKIP_SUPER_EVENTS"))
+SKIP_SUB_EVENTS = strtobool(os.getenv("SKIP_SUB_EVENTS", default="0"))
+EVENT_DAYS = int(os.getenv("EVENT_DAYS", default=31))
+EVENT_PAGE_SIZE = os.getenv("EVENT_PAGE_SIZE", default="").strip()
+# Empty uses the Linked Events default
+EVENT_PAGE_SIZE = at_least("EVENT_PAGE_SIZE", int(EVENT_PAGE_SIZE), 1) if EVENT_PAGE_SIZE else None
+FEED_MAX_ITEMS = int(os.getenv("FEED_MAX_ITEMS", default=0))
+FEED_LIMIT_VARIANTS = sorted({
+    at_least("FEED_LIMIT_VARIANTS", int(limit), 1) for limit in os.getenv("FEED_LIMIT_VARIANTS", default="").split(",") if limit.strip()
+})
+SUPPORTED_LANGUAGES = os.getenv("SUPPORTED_LANGUAGES", default="fi,en,sv").split(",")
+EVENT_QUERY_BATCH_SIZE = int(os.getenv("EVENT_QUERY_BATCH_SIZE", default=50))
+FEED_CACHE_COMPRESSION_LEVEL = int(os.getenv("FEED_CACHE_COMPRESSION_LEVEL", default=6))
+FEED_CACHE_WRITE_BATCH_SIZE = int(os.getenv("FEED_CACHE_WRITE_BATCH_SIZE", default=100))
+FEED_CACHE_POOL_SIZE = int(os.getenv("FEED_CACHE_POOL_SIZE", default=40))
+FEED_CACHE_TIMEOUT_SECONDS = float(os.getenv("FEED_CACHE_TIMEOUT_SECONDS", default=1))
+FEED_CHANGES = strtobool(os.getenv("FEED_CHANGES", default="1"))
+FEED_CHANGES_RETENTION_HOURS = float(os.getenv("FEED_CHANGES_RETENTION_HOURS", default=72))
+FEED_UPDATER = os.getenv("FEED_UPDATER", default="embedded")
+UPDATER_LOCK_FILE = os.getenv("UPDATER_LOCK_FILE", default="/tmp/linkedevents-rss-updater.lock")
+UPDATER_NICE = os.getenv("UPDATER_NICE", default="10").strip()
+# Empty keeps the default priority
+UPDATER_NICE = int(UPDATER_NICE) if UPDATER_NICE else None
+UPDATER_CPU_AFFINITY = os.getenv("UPDATER_CPU_AFFINITY")
+FEED_TRACING = strtobool(os.getenv("FEED_TRACING", default="0"))
+FEED_TRACE_HISTORY = int(os.getenv("FEED_TRACE_HISTORY", default=200))
+# The /admin/traces endpoint is disabled without a token
+FEED_TRACES_TOKEN = os.getenv("FEED_TRACES_TOKEN", default="")
+FEED_PROFILE_SAMPLE_RATE = float(os.getenv("FEED_PROFILE_SAMPLE_RATE", default=0))
+FEED_PROFILER = os.getenv("FEED_PROFILER", default="cprofile")
+FEED_PROFILE_DIR = os.getenv("FEED_PROFILE_DIR", default="/tmp/feed-profiles")
+FEED_PROFILE_KEEP = int(os.getenv("FEED_PROFILE_KEEP", default=10))
+UPSTREAM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_REQUEST_TIMEOUT_SECONDS", default=5))
+UPSTREAM_SLOT_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_SLOT_TIMEOUT_SECONDS", default=60))
+UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", default=10))
+UPSTREAM_BURST = int(os.getenv("UPSTREAM_BURST", default=20))
+UPSTREAM_MAX_CONCURRENCY_PER_HOST = int(os.getenv("UPSTREAM_MAX_CONCURRENCY_PER_HOST", default=4))
+UPSTREAM_BACKOFF_BASE_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_BASE_SECONDS", default=0.5))
+UPSTREAM_BACKOFF_MAX_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_MAX_SECONDS", default=30))
+JSON_DECODER = os.getenv("JSON_DECODER", default="auto")
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", default=10))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", default=60))
+SENTRY_DSN = os.getenv("SENTRY_DSN")
+SENTRY_TRACES_SAMPLE_RATE = float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", default=0.85))
+
+
+logger = logging.getLogger("feedgen.stdout")
+logger.setLevel(logging.getLevelName(os.getenv("LOG_LEVEL")))
+stream_handler = logging.StreamHandler(sys.stdout)
+log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] [%(processName)s: %(process)d] [%(threadName)s: %(thread)d] %(name)s: %(message)s")
+stream_handler.setFormatter(log_formatter)
+logger.addHandler(stream_handler)
+
+MEMCACHED_SERVER = 'unix:/run/memcached/memcached.sock'
+
+
+def init_sentry():
+    # sentry_sdk and its integrations are slow to import, load them only when used
+    if not SENTRY_DSN:
+        return
+    import sentry_sdk
+
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        environment=os.getenv("SENTRY_ENVIRONMENT"),
+        traces_sample_rate=SENTRY_TRACES_SAMPLE_RATE,
+    )
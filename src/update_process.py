@@ -0,0 +1,50 @@
+"""Process helpers of the feed updates, shared by the web service, the updater
+process and the fetcher pool without importing the feed update dependencies."""
+import fcntl
+import logging
+import os
+
+from typing import Optional
+
+logger = logging.getLogger("feedgen.stdout")
+
+
+def acquire_updater_lock(path: str, blocking: bool = False):
+    """Returns the open lock file while this process holds the lock, None if another
+    process holds it. POSIX record locks are not inherited by forked fetcher processes,
+    so the lock is released as soon as the holding process exits."""
+    lock_file = open(path, "a")
+    try:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def parse_cpu_list(value: str) -> set[int]:
+    """CPU list in the taskset format, e.g. "0,2-3"."""
+    cpus = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def apply_priority(nice: Optional[int], cpu_affinity: Optional[str]):
+    """Lower the scheduling priority and restrict the CPUs of the current process.
+    Processes forked from it afterwards, e.g. the fetcher pool, inherit both."""
+    if nice is not None:
+        try:
+            # Absolute value, unlike os.nice(), so repeated calls don't accumulate
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Could not set feed updater nice value {nice}: {e}")
+    if cpu_affinity:
+        try:
+            os.sched_setaffinity(0, parse_cpu_list(cpu_affinity))
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Could not set feed updater CPU affinity {cpu_affinity}: {e}")
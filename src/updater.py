@@ -0,0 +1,39 @@
+"""Feed update process. Runs the scheduled cache population separately from the
+uvicorn workers, so that feed updates don't compete with serving the feeds:
+
+    python3 updater.py
+
+Only one process per container runs the updates. The updater lock file is shared
+by this process and by the uvicorn workers when FEED_UPDATER=embedded.
+"""
+import logging
+
+from update_process import acquire_updater_lock
+
+logger = logging.getLogger("feedgen.stdout")
+
+
+def run():
+    from datetime import datetime
+
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    from settings import CACHE_TTL, UPDATER_LOCK_FILE, init_sentry
+
+    init_sentry()
+    from feed_update import populate_cache
+
+    logger.info(f"Feed updater waiting for the updater lock {UPDATER_LOCK_FILE}")
+    lock = acquire_updater_lock(UPDATER_LOCK_FILE, blocking=True)  # noqa: F841
+    logger.info("Feed updater started")
+
+    scheduler = BlockingScheduler(job_defaults={'coalesce': True, 'max_instances': 1})
+    scheduler.add_job(populate_cache, 'interval', id='populate_cache', seconds=CACHE_TTL, next_run_time=datetime.now(), misfire_grace_time=None)
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+if __name__ == "__main__":
+    run()
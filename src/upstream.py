@@ -0,0 +1,314 @@
+import fcntl
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Iterable, Optional
+
+import httpx
+
+logger = logging.getLogger("feedgen.stdout")
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+SLOT_POLL_SECONDS = 0.05
+
+# Slots of the shared state array
+_TOKENS = 0
+_LAST_REFILL = 1
+_NOT_BEFORE = 2
+_FAILURES = 3
+_OPENED_AT = 4
+# The connection slots follow the fixed slots, each as a (lease expiry, owner) pair
+_LEASES = 5
+_SLOT_SIZE = 2
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamUnavailable(UpstreamError):
+    pass
+
+
+class SlotTimeout(UpstreamError):
+    pass
+
+
+class UpstreamGuard:
+    """Rate limit, per host concurrency caps and circuit breaker shared by all
+    processes of a feed update run. The state lives in shared memory, so the guard
+    must be created before the fetcher pool and handed to its workers, which have to
+    be started with the fork start method.
+
+    Fetcher processes are killed when they time out, so nothing here may stay taken
+    by a dead process: the state is locked with a file lock released by the kernel,
+    and the connection slots are leases that expire after lease_seconds. The lease of
+    a slot is renewed while its request is running."""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        hosts: Iterable[str],
+        max_concurrency_per_host: int,
+        failure_threshold: int,
+        reset_seconds: float,
+        lease_seconds: float = 5,
+        slot_timeout: float = 60,
+    ):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lease_seconds = lease_seconds
+        self.slot_timeout = slot_timeout
+
+        # Hosts not configured explicitly share the "*" slots
+        concurrency = max(max_concurrency_per_host, 1)
+        self._slots = {}
+        for host in sorted({host_of(url) for url in hosts if url} | {"*"}):
+            start = _LEASES + len(self._slots) * concurrency * _SLOT_SIZE
+            self._slots[host] = range(start, start + concurrency * _SLOT_SIZE, _SLOT_SIZE)
+
+        # The lock file is removed right away, the forked workers inherit the open file
+        self._lock_file = tempfile.TemporaryFile()
+        self._thread_lock = threading.Lock()
+        self._state = multiprocessing.RawArray('d', _LEASES + len(self._slots) * concurrency * _SLOT_SIZE)
+        self._leases = itertools.count(1)
+        self._state[_TOKENS] = self.burst
+        self._state[_LAST_REFILL] = time.monotonic()
+
+    @contextmanager
+    def _lock(self):
+        # lockf locks are held per process, the thread lock covers the threads of a process
+        with self._thread_lock:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
+
+    def acquire_token(self):
+        """Wait for a pause set with pause() to end and, if the rate is limited, for a token."""
+        while True:
+            with self._lock():
+                now = time.monotonic()
+                wait = self._state[_NOT_BEFORE] - now
+                if self.rate <= 0:
+                    if wait <= 0:
+                        return
+                else:
+                    tokens = min(self.burst, self._state[_TOKENS] + (now - self._state[_LAST_REFILL]) * self.rate)
+                    self._state[_LAST_REFILL] = now
+                    if wait <= 0 and tokens >= 1:
+                        self._state[_TOKENS] = tokens - 1
+                        return
+                    self._state[_TOKENS] = tokens
+                    wait = max(wait, (1 - tokens) / self.rate)
+            time.sleep(wait)
+
+    @contextmanager
+    def slot(self, url: str):
+        """Hold one of the connection slots of the host of the url."""
+        index, owner = self.acquire_slot(url)
+        done = threading.Event()
+        threading.Thread(target=self._renew_slot, args=(index, owner, done), name="slot-lease", daemon=True).start()
+        try:
+            yield
+        finally:
+            done.set()
+            self.release_slot(index, owner)
+
+    def acquire_slot(self, url: str):
+        slots = self._slots.get(host_of(url), self._slots["*"])
+        # Unique among the processes sharing the state, pids are below 2 ** 22
+        owner = os.getpid() * 2 ** 30 + next(self._leases) % 2 ** 30
+        deadline = time.monotonic() + self.slot_timeout
+        while True:
+            with self._lock():
+                now = time.monotonic()
+                for index in slots:
+                    if self._state[index] <= now:
+                        self._state[index] = now + self.lease_seconds
+                        self._state[index + 1] = owner
+                        return index, owner
+                next_free = min(self._state[index] for index in slots)
+            if now >= deadline:
+                raise SlotTimeout(f"Timed out waiting for a connection slot: {url}")
+            time.sleep(max(min(next_free - now, deadline - now, SLOT_POLL_SECONDS), 0))
+
+    def renew_slot(self, index: int, owner: float) -> bool:
+        with self._lock():
+            if self._state[index + 1] != owner:
+                return False
+            self._state[index] = time.monotonic() + self.lease_seconds
+            return True
+
+    def _renew_slot(self, index: int, owner: float, done: threading.Event):
+        while not done.wait(self.lease_seconds / 2):
+            if not self.renew_slot(index, owner):
+                return
+
+    def release_slot(self, index: int, owner: float):
+        with self._lock():
+            # The lease may have expired and been taken over already
+            if self._state[index + 1] == owner:
+                self._state[index] = 0
+                self._state[index + 1] = 0
+
+    def pause(self, seconds: float):
+        """Hold back all requests of the run, e.g. after a 429 with Retry-After."""
+        with self._lock():
+            self._state[_NOT_BEFORE] = max(self._state[_NOT_BEFORE], time.monotonic() + seconds)
+
+    def is_open(self) -> bool:
+        with self._lock():
+            opened_at = self._state[_OPENED_AT]
+            return opened_at > 0 and time.monotonic() - opened_at < self.reset_seconds
+
+    def record_success(self):
+        with self._lock():
+            self._state[_FAILURES] = 0
+            self._state[_OPENED_AT] = 0
+
+    def record_failure(self):
+        with self._lock():
+            self._state[_FAILURES] += 1
+            if self._state[_FAILURES] >= self.failure_threshold:
+                if self._state[_OPENED_AT] == 0:
+                    logger.error(
+                        f"Upstream circuit breaker opened after {int(self._state[_FAILURES])} consecutive failures"
+                    )
+                # A failed trial request after the reset period opens the breaker again
+                self._state[_OPENED_AT] = time.monotonic()
+
+
+_installed_guard: Optional[UpstreamGuard] = None
+
+
+def install_guard(guard: UpstreamGuard):
+    """Set the guard used by all UpstreamClients of this process. Also usable as a
+    process pool initializer."""
+    global _installed_guard
+    _installed_guard = guard
+
+
+def get_json_decoder(name: str = "auto") -> Callable[[bytes], Any]:
+    """orjson decodes the response bytes directly and several times faster than the
+    standard library. It is optional, json is used when it is not installed."""
+    if name in ("auto", "orjson"):
+        try:
+            import orjson
+            return orjson.loads
+        except ImportError:
+            if name == "orjson":
+                logger.warning("orjson is not installed, using json instead")
+    elif name != "json":
+        raise ValueError(f"Unknown JSON decoder: {name}")
+    return json.loads
+
+
+def host_of(url: str) -> str:
+    return urllib.parse.urlsplit(url).netloc
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamClient:
+    """httpx client wrapper for all upstream APIs. Requests go through the installed
+    UpstreamGuard and are retried with jittered exponential backoff on connection
+    errors, 429 and 5xx responses. Other responses are returned to the caller as is."""
+
+    def __init__(
+        self,
+        guard_factory: Callable[[], UpstreamGuard],
+        retries: int = 3,
+        backoff_base_seconds: float = 0.5,
+        backoff_max_seconds: float = 30,
+        json_decoder: str = "auto",
+        timeout: float = 5,
+        transport: Optional[httpx.BaseTransport] = None,
+    ):
+        self.guard_factory = guard_factory
+        self.retries = retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.loads = get_json_decoder(json_decoder)
+        self._client = httpx.Client(timeout=timeout, transport=transport)
+        self._fallback_guard = None
+
+    @property
+    def guard(self) -> UpstreamGuard:
+        if _installed_guard is not None:
+            return _installed_guard
+        if self._fallback_guard is None:
+            self._fallback_guard = self.guard_factory()
+        return self._fallback_guard
+
+    def json(self, response: httpx.Response) -> Any:
+        """Decode the response body. Callers should decode each response only once."""
+        return self.loads(response.content)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+
+    def get(self, url: str, **kwargs) -> httpx.Response:
+        guard = self.guard
+        attempt = 0
+        while True:
+            if guard.is_open():
+                raise UpstreamUnavailable(f"Circuit breaker open, skipped request: {url}")
+
+            guard.acquire_token()
+            try:
+                with guard.slot(url):
+                    response = self._client.get(url, **kwargs)
+                    error = None
+            except (httpx.TransportError, SlotTimeout) as e:
+                response = None
+                error = e
+
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                guard.record_success()
+                return response
+
+            delay = self.backoff(attempt)
+            if response is not None and response.status_code == 429:
+                retry_after = retry_after_seconds(response)
+                if retry_after is not None:
+                    delay = min(max(delay, retry_after), self.backoff_max_seconds)
+                guard.pause(delay)
+            elif not isinstance(error, SlotTimeout):
+                # Waiting for the other requests to the host is not a failure of the host
+                guard.record_failure()
+
+            reason = f"HTTP {response.status_code}" if response is not None else repr(error)
+            if attempt >= self.retries:
+                raise UpstreamError(f"Giving up on {url} after {attempt + 1} attempts: {reason}")
+
+            logger.warning(f"Upstream request failed ({reason}), retrying in {delay:.1f}s: {url}")
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,14 @@
+def strtobool(value, raise_exc=False):
+    _true_set = {'yes', 'true', 't', 'y', '1'}
+    _false_set = {'no', 'false', 'f', 'n', '0'}
+
+    if isinstance(value, str):
+        value = value.lower()
+        if value in _true_set:
+            return True
+        if value in _false_set:
+            return False
+
+    if raise_exc:
+        raise ValueError('Expected "%s"' % '", "'.join(_true_set | _false_set))
+    return None
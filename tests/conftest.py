@@ -0,0 +1,23 @@
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+# Settings the modules require, so that the tests run without an .env file
+for name, value in {
+    "APP_TITLE": "Linked Events RSS tests",
+    "APP_VERSION": "0.0.0",
+    "FEED_BASE_URL": "http://localhost",
+    "LINKED_EVENTS_BASE_URL": "http://localhost/linkedevents/v1",
+    "KIRKANTA_BASE_URL": "http://localhost/kirkanta/v4",
+    "CACHE_TTL": "3600",
+    "CACHE_MAX_SIZE": "3600",
+    "UVICORN_WORKERS": "1",
+    "CONSORTIUM_ID": "0",
+    "API_CLIENT_POOL_SIZE": "1",
+    "LOAD_IMAGES_FROM_API": "0",
+    "SKIP_SUPER_EVENTS": "0",
+    "LOG_LEVEL": "WARNING",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,47 @@
+class MemoryCache:
+    """In-memory stand-in for the pymemcache client used by the service. Values are
+    stored serialized like in memcached, so compressed feeds are decompressed on read."""
+
+    def __init__(self, serde):
+        self.serde = serde
+        self.values = {}
+
+    def get(self, key, default=None):
+        if key not in self.values:
+            return default
+        return self.serde.deserialize(key, *self.values[key])
+
+    def get_many(self, keys):
+        return {key: self.get(key) for key in keys if key in self.values}
+
+    def set(self, key, value, *args, **kwargs):
+        self.values[key] = self.serde.serialize(key, value.encode() if isinstance(value, str) else value)
+        return True
+
+    def set_many(self, values, *args, **kwargs):
+        for key, value in values.items():
+            self.set(key, value)
+        return []
+
+    def add(self, key, value, *args, **kwargs):
+        if key in self.values:
+            return False
+        return self.set(key, value)
+
+    def incr(self, key, value, *args, **kwargs):
+        if key not in self.values:
+            return None
+        value = int(self.get(key)) + value
+        self.set(key, str(value))
+        return value
+
+    def delete(self, key, *args, **kwargs):
+        return self.values.pop(key, None) is not None
+
+    def delete_many(self, keys, *args, **kwargs):
+        for key in keys:
+            self.delete(key)
+        return True
+
+    def close(self):
+        pass
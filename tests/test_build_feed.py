@@ -0,0 +1,68 @@
+import zlib
+
+import httpx
+
+import feed_update
+
+from event_record import EventRecord
+from upstream import UpstreamClient, UpstreamGuard
+
+LE = feed_update.LINKED_EVENTS_BASE_URL
+PLACES = {"tprek:1": {"@id": f"{LE}/place/tprek:1/", "name": {"fi": "Paikka"}}}
+
+
+def event(id: str, **fields) -> EventRecord:
+    return EventRecord.from_json({
+        "id": id,
+        "name": {"fi": f"Tapahtuma {id}"},
+        "location": {"@id": f"{LE}/place/tprek:1/"},
+        "start_time": "2026-10-10T10:00:00Z",
+        "end_time": "2026-10-10T12:00:00Z",
+        "last_modified_time": "2026-10-01T10:00:00Z",
+        **fields,
+    })
+
+
+def build(events: list) -> str:
+    values = feed_update.build_feed("tprek:1", "fi", PLACES, events, generation=1, previous_generation=None, now=0)
+    assert values is not None
+    return zlib.decompress(values["tprek:1,fi"]).decode()
+
+
+def test_event_without_end_time_is_rendered_without_dtend():
+    xml = build([event("e1"), event("e2", end_time=None), event("e3")])
+
+    assert xml.count("<item>") == 3
+    assert xml.count("<xcal:dtstart>") == 3
+    assert xml.count("<xcal:dtend>") == 2
+    assert xml.count("<ev:dtend>") == 2
+
+
+def test_event_without_times_is_rendered():
+    xml = build([event("e1", start_time=None, end_time=None, last_modified_time=None)])
+
+    assert xml.count("<item>") == 1
+    assert "dtstart>" not in xml
+    assert "<item><title>Tapahtuma e1</title><guid>" in xml
+
+
+def test_failed_place_is_left_out_of_the_batch(monkeypatch):
+    event_locations = []
+
+    def handler(request):
+        if "/place/tprek:2/" in str(request.url):
+            return httpx.Response(503)
+        if "/place/" in str(request.url):
+            return httpx.Response(200, json={"@id": str(request.url)})
+        event_locations.append(request.url.params["location"])
+        return httpx.Response(200, json={"meta": {"next": None}, "data": []})
+
+    guard = UpstreamGuard(rate=0, burst=1, hosts=[LE], max_concurrency_per_host=2, failure_threshold=100, reset_seconds=60)
+    client = UpstreamClient(lambda: guard, retries=1, backoff_base_seconds=0, transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(feed_update, "http_client", client)
+
+    places, events = feed_update.fetch_places_and_events(["tprek:1", "tprek:2", "tprek:3"], 31)
+
+    assert sorted(places) == ["tprek:1", "tprek:3"]
+    assert events == []
+    assert event_locations == ["tprek:1,tprek:3"]
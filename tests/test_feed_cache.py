@@ -0,0 +1,125 @@
+import pytest
+
+from feed_cache import GENERATION_KEY, CacheSerde, Compressed, FeedCache, FeedCacheWriter, compress, manifest_key
+from tests.memory_cache import MemoryCache
+
+
+@pytest.fixture
+def client():
+    return MemoryCache(CacheSerde())
+
+
+@pytest.fixture
+def cache(client, monkeypatch):
+    # Readers look up the current generation on every read
+    monkeypatch.setattr("feed_cache.GENERATION_CHECK_INTERVAL_SECONDS", 0)
+    return FeedCache(client)
+
+
+def write(client, values: dict, keep: list = (), **kwargs) -> FeedCacheWriter:
+    writer = FeedCacheWriter(client, **kwargs)
+    writer.add({key: compress(value, 6) for key, value in values.items()})
+    writer.keep(list(keep))
+    return writer
+
+
+def test_compressed_values_are_stored_compressed(client):
+    client.set("a", compress(b"feed" * 100, 6))
+    client.set("b", b"feed")
+
+    assert client.values["a"][1] and len(client.values["a"][0]) < 400
+    assert client.values["b"] == (b"feed", 0)
+    assert client.get("a") == b"feed" * 100
+    assert not isinstance(compress(b"feed", 0), Compressed)
+
+
+def test_readers_switch_to_a_generation_when_it_is_published(client, cache):
+    writer = write(client, {"a,fi": b"first"})
+    assert (writer.previous, writer.generation) == (None, 1)
+    assert cache.get("a,fi") is None
+
+    assert writer.publish()
+    assert cache.get_with_generation("a,fi") == (1, b"first")
+
+    writer = write(client, {"a,fi": b"second"}, batch_size=1)
+    # Flushed already but not published
+    assert client.get("feed:2:a,fi") == b"second"
+    assert cache.get_with_generation("a,fi") == (1, b"first")
+
+    writer.publish()
+    assert cache.get_with_generation("a,fi") == (2, b"second")
+
+
+def test_keep_copies_feeds_from_the_previous_generation(client, cache):
+    write(client, {"a,fi": b"a1", "b,fi": b"b1"}).publish()
+
+    writer = write(client, {"a,fi": b"a2"}, keep=["b,fi", "missing,fi"])
+    writer.publish()
+
+    assert cache.get("a,fi") == b"a2"
+    assert cache.get("b,fi") == b"b1"
+    assert cache.get("missing,fi") is None
+    assert sorted(writer.keys) == ["a,fi", "b,fi"]
+    assert client.get(manifest_key(2)) == b"a,fi\nb,fi"
+
+
+def test_keep_copies_feeds_stored_before_generations(client, cache):
+    # Feeds of the earlier versions had no generation prefix
+    client.set("a,fi", b"legacy")
+    assert cache.get("a,fi") == b"legacy"
+
+    writer = write(client, {}, keep=["a,fi"])
+    assert writer.publish()
+
+    assert cache.get_with_generation("a,fi") == (1, b"legacy")
+
+
+def test_publish_removes_the_generation_before_the_previous(client):
+    for generation in range(1, 4):
+        write(client, {"a,fi": f"a{generation}".encode(), f"only{generation},fi": b"x"}, batch_size=1).publish()
+
+    assert client.get(GENERATION_KEY) == b"3"
+    assert [key for key in client.values if key.startswith("feed:1")] == []
+    # Readers may still be using the previous generation
+    assert client.get("feed:2:a,fi") == b"a2"
+    assert client.get("feed:2:only2,fi") == b"x"
+    assert client.get(manifest_key(2)) is not None
+
+
+def test_nothing_is_published_without_feeds(client, cache):
+    write(client, {"a,fi": b"first"}).publish()
+
+    writer = write(client, {}, keep=["missing,fi"])
+    assert not writer.publish()
+    assert cache.get_with_generation("a,fi") == (1, b"first")
+
+
+def test_too_long_keys_are_not_stored(client):
+    writer = write(client, {"a,fi": b"a", "x" * 250: b"b"})
+    writer.publish()
+
+    assert writer.keys == ["a,fi"]
+
+
+def test_generation_at_publish_times(client, cache, monkeypatch):
+    for generation, published_at in enumerate([1000, 2000, 2000, 3000], start=1):
+        monkeypatch.setattr("time.time", lambda: published_at)
+        write(client, {"a,fi": b"a"}).publish()
+
+    assert cache.published_at(2) == 2000
+    assert cache.published_at(9) is None
+    assert cache.generation_at(999) is None
+    assert cache.generation_at(1500) == 1
+    # Of generations published within the same second the first one
+    assert cache.generation_at(2000) == 2
+    assert cache.generation_at(2999.5) == 2
+    assert cache.generation_at(5000) == 4
+
+
+def test_old_publish_times_are_dropped(client, cache, monkeypatch):
+    for published_at in [1000, 2000, 3000]:
+        monkeypatch.setattr("time.time", lambda: published_at)
+        write(client, {"a,fi": b"a"}, published_history_seconds=1500).publish()
+
+    assert cache.published_at(1) is None
+    assert cache.generation_at(2500) == 2
@@ -0,0 +1,155 @@
+from email.utils import parsedate_to_datetime
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+import feed_changes
+import service
+
+from feed_cache import CacheSerde, FeedCache, FeedCacheWriter
+from tests.memory_cache import MemoryCache
+
+RETENTION = 3600
+HEAD = "<?xml version='1.0' encoding='UTF-8'?><rss><channel><title>Paikka</title>"
+TAIL = "</channel></rss>"
+
+
+def item(guid: str, title: str = None) -> str:
+    return f"<item><title>{title or guid}</title><guid>{guid}</guid></item>"
+
+
+def feed(*items: str) -> bytes:
+    return (HEAD + "".join(items) + TAIL).encode()
+
+
+def history(*feeds, now: float = 0, retention: float = RETENTION):
+    """The history after storing the feeds as generations 1, 2, ..."""
+    current = None
+    for generation, xml in enumerate(feeds, start=1):
+        current = feed_changes.update_history(current, xml, generation, now + generation, retention)
+    return current
+
+
+def changes(history: dict, current_generation: int, since_generation):
+    xml, delta = feed_changes.render_changes(history, current_generation, since_generation)
+    return xml.decode(), delta
+
+
+def removed(guid: str) -> str:
+    return f"<item><guid>{guid}</guid><category>removed</category></item>"
+
+
+def test_split_items():
+    head, items, tail = feed_changes.split_items(feed(item("a"), item("b")))
+
+    assert head == HEAD.encode()
+    assert items == [("a", item("a").encode()), ("b", item("b").encode())]
+    assert tail == TAIL.encode()
+    assert feed_changes.split_items(feed()) == (HEAD.encode(), [], TAIL.encode())
+
+
+def test_added_changed_and_removed_items():
+    result = history(
+        feed(item("a"), item("b"), item("c")),
+        feed(item("a"), item("b", "changed"), item("d")),
+    )
+
+    assert changes(result, 2, 1) == (HEAD + item("b", "changed") + item("d") + removed("c") + TAIL, True)
+    assert changes(result, 2, 2) == (HEAD + TAIL, True)
+
+
+def test_unchanged_items_keep_their_generation():
+    result = history(feed(item("a"), item("b")), feed(item("a"), item("b", "changed")), feed(item("a"), item("b", "changed")))
+
+    assert [changed for guid, xml, changed in result["items"]] == [1, 2]
+    assert changes(result, 3, 2) == (HEAD + TAIL, True)
+    assert changes(result, 3, 1) == (HEAD + item("b", "changed") + TAIL, True)
+
+
+def test_readded_item_is_not_removed():
+    result = history(feed(item("a"), item("b")), feed(item("a")), feed(item("a"), item("b")))
+
+    assert result["removed"] == []
+    assert changes(result, 3, 1) == (HEAD + item("b") + TAIL, True)
+
+
+def test_removed_items_expire_and_move_the_horizon():
+    result = history(feed(item("a"), item("b")), feed(item("a")), now=0, retention=10)
+    assert result["removed"] == [["b", 2, 2]]
+    assert result["horizon"] == 1
+
+    result = feed_changes.update_history(result, feed(item("a")), 3, 20, 10)
+    assert result["removed"] == []
+    assert result["horizon"] == 2
+    # The removal of b can't be told any more to clients that had generation 1
+    assert changes(result, 3, 1) == (HEAD + item("a") + TAIL, False)
+    assert changes(result, 3, 2) == (HEAD + TAIL, True)
+
+
+@pytest.mark.parametrize("since_generation", [None, 0, 4])
+def test_whole_feed_outside_of_the_history(since_generation):
+    result = history(feed(item("a")), feed(item("a"), item("b")))
+    result["horizon"] = 1
+
+    assert changes(result, 2, since_generation) == (HEAD + item("a") + item("b") + TAIL, False)
+
+
+def test_history_round_trip():
+    result = history(feed(item("a")), feed(item("b")))
+
+    assert feed_changes.loads(feed_changes.dumps(result)) == result
+    assert feed_changes.loads(None) is None
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    client = MemoryCache(CacheSerde())
+    monkeypatch.setattr(service, "feed_cache", FeedCache(client))
+    # Readers look up the current generation on every request
+    monkeypatch.setattr("feed_cache.GENERATION_CHECK_INTERVAL_SECONDS", 0)
+    return client
+
+
+def publish(client, *items: str):
+    writer = FeedCacheWriter(client, compression_level=0)
+    key = feed_changes.changes_key("tprek:1", "fi")
+    previous = feed_changes.loads(client.get(f"feed:{writer.previous}:{key}")) if writer.previous else None
+    xml = feed(*items)
+    writer.add({"tprek:1,fi": xml, key: feed_changes.dumps(feed_changes.update_history(previous, xml, writer.generation, 0, RETENTION))})
+    return writer
+
+
+def test_changes_built_before_a_poll_are_returned_after_it(cache):
+    publish(cache, item("a")).publish()
+    writer = publish(cache, item("a"), item("b"))
+
+    # The client polls while the next generation is being built
+    client = TestClient(service.app)
+    response = client.get("/events", params={"location": "tprek:1", "preferred_language": "fi"})
+    assert response.headers["X-Feed-Generation"] == "1"
+    last_modified = response.headers["Last-Modified"]
+
+    writer.publish()
+    response = client.get(
+        "/events/changes", params={"location": "tprek:1", "preferred_language": "fi"}, headers={"If-Modified-Since": last_modified}
+    )
+    assert response.headers["X-Feed-Changes"] == "delta"
+    assert response.headers["X-Feed-Generation"] == "2"
+    assert response.text == HEAD + item("b") + TAIL
+
+    since = parsedate_to_datetime(last_modified).isoformat()
+    response = client.get("/events/changes", params={"location": "tprek:1", "preferred_language": "fi", "since": since})
+    assert response.text == HEAD + item("b") + TAIL
+    response = client.get("/events/changes", params={"location": "tprek:1", "preferred_language": "fi", "since": "1"})
+    assert response.text == HEAD + item("b") + TAIL
+
+
+def test_changes_since_a_time_before_the_history(cache):
+    publish(cache, item("a")).publish()
+
+    response = TestClient(service.app).get(
+        "/events/changes", params={"location": "tprek:1", "preferred_language": "fi", "since": "2000-01-01T00:00:00Z"}
+    )
+    assert response.headers["X-Feed-Changes"] == "full"
+    assert response.text == HEAD + item("a") + TAIL
@@ -0,0 +1,37 @@
+import pytest
+
+from feed_options import FeedOptions
+
+DEFAULTS = FeedOptions(days=31, max_items=0, skip_super_events=True, skip_sub_events=False)
+
+
+def test_custom_data_overrides_defaults():
+    options = DEFAULTS.with_custom_data({
+        "le_rss_days": "7",
+        "le_rss_max_items": " 20 ",
+        "le_rss_skip_super_events": "0",
+        "le_rss_skip_sub_events": "1",
+    })
+
+    assert options == FeedOptions(days=7, max_items=20, skip_super_events=False, skip_sub_events=True)
+
+
+def test_empty_custom_data_keeps_defaults():
+    assert DEFAULTS.with_custom_data({"le_rss_days": " ", "le_rss_max_items": None}) == DEFAULTS
+
+
+@pytest.mark.parametrize("field, value", [
+    ("le_rss_days", "0"),
+    ("le_rss_days", "-3"),
+    ("le_rss_days", "7.5"),
+    ("le_rss_days", "week"),
+    ("le_rss_max_items", "-1"),
+    ("le_rss_skip_super_events", "maybe"),
+])
+def test_invalid_custom_data_falls_back_to_default(field, value, caplog):
+    assert DEFAULTS.with_custom_data({field: value}) == DEFAULTS
+    assert f"Invalid Kirkanta custom data value {field}={value}" in caplog.text
+
+
+def test_zero_max_items_means_no_limit():
+    assert DEFAULTS.with_custom_data({"le_rss_max_items": "0"}).max_items == 0
@@ -0,0 +1,68 @@
+import pytest
+
+from fastapi.testclient import TestClient
+
+import profiling
+import service
+
+from feed_cache import CacheSerde
+from tests.memory_cache import MemoryCache
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    store = MemoryCache(CacheSerde())
+    monkeypatch.setattr(profiling, "settings", profiling.ProfilingSettings(store=store, enabled=True))
+    return store
+
+
+def latest() -> dict:
+    return profiling.recent_traces(1)[0]
+
+
+def test_running_stages_are_published():
+    with profiling.build("tprek:1,fi"):
+        with profiling.stage("parse"):
+            with profiling.stage("parse.images"):
+                assert [stage for stage, started_at in latest()["running"]] == ["parse", "parse.images"]
+        with profiling.stage("to_xml"):
+            assert [stage for stage, started_at in latest()["running"]] == ["to_xml"]
+
+    trace = latest()
+    assert trace["status"] == "ok"
+    assert trace["running"] == []
+    assert sorted(trace["stages"]) == ["parse", "parse.images", "to_xml"]
+
+
+def test_timeout_log_names_the_running_stage(caplog):
+    with profiling.build("tprek:1,fi"):
+        with profiling.stage("fetch"):
+            pass
+        with profiling.stage("parse"), profiling.stage("parse.images"):
+            # The pool kills the build here, the trace is read by the parent process
+            profiling.timed_out("tprek:1,fi")
+
+    assert "Build trace for tprek:1,fi at timeout: running parse (0.0s) > parse.images (0.0s)" in caplog.text
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(service, "FEED_TRACING", True)
+    monkeypatch.setattr(service, "FEED_TRACES_TOKEN", "secret")
+    with profiling.build("tprek:1,fi"):
+        pass
+    return TestClient(service.app)
+
+
+def test_traces_require_the_token(client):
+    assert client.get("/admin/traces").status_code == 401
+    assert client.get("/admin/traces", headers={"Authorization": "Bearer other"}).status_code == 401
+
+    response = client.get("/admin/traces", headers={"Authorization": "Bearer secret"})
+    assert [trace["name"] for trace in response.json()] == ["tprek:1,fi"]
+
+
+def test_traces_are_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(service, "FEED_TRACES_TOKEN", "")
+
+    assert client.get("/admin/traces", headers={"Authorization": "Bearer "}).status_code == 404
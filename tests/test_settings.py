@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from tests.conftest import SRC_DIR
+
+
+def import_settings(**env) -> subprocess.CompletedProcess:
+    # A fresh interpreter, the settings are read once on import
+    return subprocess.run(
+        [sys.executable, "-c", "import settings; print(settings.EVENT_PAGE_SIZE, settings.FEED_LIMIT_VARIANTS)"],
+        cwd=SRC_DIR, env={**os.environ, **env}, capture_output=True, text=True,
+    )
+
+
+def test_valid_sizes():
+    result = import_settings(EVENT_PAGE_SIZE=" 100 ", FEED_LIMIT_VARIANTS="50, 10,50")
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "100 [10, 50]"
+    assert import_settings(EVENT_PAGE_SIZE="", FEED_LIMIT_VARIANTS="").stdout.strip() == "None []"
+
+
+@pytest.mark.parametrize("name, value", [
+    ("EVENT_PAGE_SIZE", "0"),
+    ("EVENT_PAGE_SIZE", "-5"),
+    ("FEED_LIMIT_VARIANTS", "10,0"),
+    ("FEED_LIMIT_VARIANTS", "-1"),
+])
+def test_sizes_below_one_are_rejected_at_startup(name, value):
+    result = import_settings(**{name: value})
+
+    assert result.returncode != 0
+    assert f"ValueError: {name} must be at least 1" in result.stderr
@@ -0,0 +1,272 @@
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import httpx
+import pytest
+
+from upstream import UpstreamClient, UpstreamError, UpstreamGuard, UpstreamUnavailable, install_guard, retry_after_seconds
+
+URL = "http://localhost/linkedevents/v1/event/"
+
+
+def create_guard(**kwargs) -> UpstreamGuard:
+    options = dict(
+        rate=0, burst=1, hosts=[URL], max_concurrency_per_host=2, failure_threshold=3, reset_seconds=60,
+        lease_seconds=5, slot_timeout=5,
+    )
+    return UpstreamGuard(**{**options, **kwargs})
+
+
+def create_client(guard: UpstreamGuard, responses: list, **kwargs) -> UpstreamClient:
+    """A client answering the requests with the given responses, the last one repeated."""
+    def handler(request):
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+
+    options = dict(retries=3, backoff_base_seconds=0, backoff_max_seconds=5)
+    return UpstreamClient(lambda: guard, transport=httpx.MockTransport(handler), **{**options, **kwargs})
+
+
+@pytest.fixture(autouse=True)
+def no_installed_guard():
+    install_guard(None)
+    yield
+    install_guard(None)
+
+
+def elapsed(function) -> float:
+    start = time.monotonic()
+    function()
+    return time.monotonic() - start
+
+
+def test_token_bucket_allows_burst_then_rate():
+    guard = create_guard(rate=20, burst=3)
+
+    assert elapsed(lambda: [guard.acquire_token() for _ in range(3)]) < 0.03
+    assert 0.04 < elapsed(guard.acquire_token) < 0.1
+    time.sleep(0.2)
+    assert elapsed(lambda: [guard.acquire_token() for _ in range(3)]) < 0.03
+
+
+def test_token_bucket_disabled_with_zero_rate():
+    guard = create_guard(rate=0, burst=1)
+
+    assert elapsed(lambda: [guard.acquire_token() for _ in range(100)]) < 0.05
+
+
+def test_retry_after_pauses_all_requests():
+    guard = create_guard(rate=100, burst=10)
+    client = create_client(guard, [httpx.Response(429, headers={"Retry-After": "0.3"}), httpx.Response(200)])
+
+    assert 0.3 <= elapsed(lambda: client.get(URL)) < 0.6
+    # The pause applies to the requests of other processes too
+    guard.pause(0.2)
+    assert 0.15 < elapsed(guard.acquire_token) < 0.4
+
+
+def test_retry_after_pauses_requests_without_rate_limit():
+    guard = create_guard(rate=0)
+    client = create_client(guard, [httpx.Response(429, headers={"Retry-After": "0.3"}), httpx.Response(200)])
+
+    assert 0.3 <= elapsed(lambda: client.get(URL)) < 0.6
+    guard.pause(0.2)
+    assert 0.15 < elapsed(guard.acquire_token) < 0.4
+    assert elapsed(guard.acquire_token) < 0.05
+
+
+def test_retry_after_is_capped_by_max_backoff():
+    guard = create_guard()
+    client = create_client(guard, [httpx.Response(429, headers={"Retry-After": "3600"}), httpx.Response(200)], backoff_max_seconds=0.1)
+
+    assert elapsed(lambda: client.get(URL)) < 0.5
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(httpx.Response(429, headers={"Retry-After": "12"})) == 12
+    assert retry_after_seconds(httpx.Response(429, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert retry_after_seconds(httpx.Response(429, headers={"Retry-After": "soon"})) is None
+    assert retry_after_seconds(httpx.Response(429)) is None
+
+
+def test_retries_then_gives_up():
+    guard = create_guard(failure_threshold=100)
+    client = create_client(guard, [httpx.Response(503)], retries=2)
+
+    with pytest.raises(UpstreamError, match="after 3 attempts: HTTP 503"):
+        client.get(URL)
+
+
+def test_other_responses_are_returned_as_is():
+    guard = create_guard()
+    client = create_client(guard, [httpx.Response(404)])
+
+    assert client.get(URL).status_code == 404
+    assert not guard.is_open()
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    guard = create_guard(failure_threshold=3)
+    client = create_client(guard, [httpx.Response(500)], retries=5)
+
+    with pytest.raises(UpstreamUnavailable):
+        client.get(URL)
+    assert guard.is_open()
+    with pytest.raises(UpstreamUnavailable):
+        client.get(URL)
+
+
+def test_circuit_breaker_success_resets_failures():
+    guard = create_guard(failure_threshold=3)
+    client = create_client(guard, [httpx.Response(500), httpx.Response(500), httpx.Response(200), httpx.Response(500)], retries=0)
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            client.get(URL)
+    client.get(URL)
+    with pytest.raises(UpstreamError):
+        client.get(URL)
+    assert not guard.is_open()
+
+
+def test_circuit_breaker_half_open_after_reset():
+    guard = create_guard(failure_threshold=2, reset_seconds=0.2)
+    for _ in range(2):
+        guard.record_failure()
+    assert guard.is_open()
+
+    time.sleep(0.25)
+    assert not guard.is_open()
+    # A failed trial request opens the breaker again right away
+    guard.record_failure()
+    assert guard.is_open()
+
+    time.sleep(0.25)
+    assert not guard.is_open()
+    guard.record_success()
+    guard.record_failure()
+    assert not guard.is_open()
+
+
+def test_slots_are_released_after_requests():
+    guard = create_guard(max_concurrency_per_host=1, slot_timeout=0.1)
+    client = create_client(guard, [httpx.Response(200), httpx.Response(500), httpx.Response(200)])
+
+    client.get(URL)
+    client.get(URL)
+    with guard.slot(URL):
+        pass
+
+
+def test_slot_wait_is_bounded():
+    guard = create_guard(max_concurrency_per_host=2, slot_timeout=0.1)
+
+    with guard.slot(URL), guard.slot(URL):
+        with pytest.raises(UpstreamError, match="connection slot"):
+            guard.acquire_slot(URL)
+        # Other hosts have slots of their own
+        with guard.slot("http://example.org/"):
+            pass
+
+
+def test_slot_is_kept_while_the_request_runs():
+    guard = create_guard(max_concurrency_per_host=1, lease_seconds=0.1, slot_timeout=0.05)
+
+    with guard.slot(URL):
+        # Well past the lease, which is renewed in the background
+        time.sleep(0.35)
+        with pytest.raises(UpstreamError, match="connection slot"):
+            guard.acquire_slot(URL)
+    with guard.slot(URL):
+        pass
+
+
+def test_slot_timeout_is_retried():
+    guard = create_guard(max_concurrency_per_host=1, failure_threshold=1, slot_timeout=0.05)
+    client = create_client(guard, [httpx.Response(200)], retries=10, backoff_base_seconds=0.02, backoff_max_seconds=0.05)
+
+    def other_request():
+        with guard.slot(URL):
+            time.sleep(0.2)
+
+    other = threading.Thread(target=other_request)
+    other.start()
+    time.sleep(0.02)
+    assert client.get(URL).status_code == 200
+    other.join()
+    # Waiting for a slot is not counted as an upstream failure
+    assert not guard.is_open()
+
+
+def test_concurrent_requests_share_the_slots():
+    guard = create_guard(max_concurrency_per_host=4, lease_seconds=0.2, slot_timeout=5)
+    running = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def handler(request):
+        with lock:
+            running.append(request)
+            peak[0] = max(peak[0], len(running))
+        # Longer than the lease
+        time.sleep(0.25)
+        with lock:
+            running.remove(request)
+        return httpx.Response(200)
+
+    client = UpstreamClient(lambda: guard, retries=0, transport=httpx.MockTransport(handler))
+    failures = []
+
+    def fetch():
+        for _ in range(2):
+            try:
+                client.get(URL)
+            except UpstreamError as e:
+                failures.append(e)
+
+    threads = [threading.Thread(target=fetch) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert failures == []
+    assert peak[0] == 4
+
+
+def hold_slot_and_die(guard: UpstreamGuard, url: str):
+    guard.acquire_slot(url)
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def hold_lock_and_die(guard: UpstreamGuard):
+    with guard._lock():
+        os.kill(os.getpid(), signal.SIGKILL)
+
+
+def run_killed(target, *args):
+    process = multiprocessing.get_context("fork").Process(target=target, args=args)
+    process.start()
+    process.join()
+    assert process.exitcode == -signal.SIGKILL
+
+
+def test_slot_of_killed_process_expires():
+    guard = create_guard(max_concurrency_per_host=2, lease_seconds=0.3, slot_timeout=1)
+    for _ in range(2):
+        run_killed(hold_slot_and_die, guard, URL)
+
+    start = time.monotonic()
+    with guard.slot(URL):
+        assert 0.1 < time.monotonic() - start < 0.6
+
+
+def test_lock_of_killed_process_is_released():
+    guard = create_guard(rate=100, burst=1)
+    run_killed(hold_lock_and_die, guard)
+
+    assert elapsed(guard.acquire_token) < 0.1
+    guard.record_failure()
+    assert not guard.is_open()